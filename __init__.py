@@ -14,27 +14,124 @@ bl_info = {
 
 import bpy
 from bpy.props import (StringProperty,
+                       BoolProperty,
                        FloatProperty,
                        EnumProperty,
                        PointerProperty,
                        IntProperty,
                        CollectionProperty,
                        )
+from bpy.app.handlers import persistent
 from bpy.types import (
                        PropertyGroup,
                        )
 import math
+import bisect
+import contextlib
+import cProfile
+import heapq
+import itertools
+from array import array
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import pstats
 import subprocess
 import sys
 import os
+import re
+import threading
+import time
+import tracemalloc
+
+from .midi_timeline import (
+    PITCH_BEND_CONTROLLER,
+    CachedMidiFile,
+    get_note_octave,
+)
 
 # Constants
 
-DEFAULT_TEMPO = 500000
+# Parsed MIDI cache limits
+MIDI_CACHE_MAX_FILES = 8
+MIDI_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Animation setting choices, shared by the scene settings and track targets
+ANIMATION_TYPE_ITEMS = [ ('MOVE', "Move", ""),
+                         ('SCALE', "Scale", ""),
+                         ('ROTATE', "Rotate", ""),
+                       ]
+AXIS_ITEMS = [ ('0', "X", ""),
+               ('1', "Y", ""),
+               ('2', "Z", ""),
+             ]
+DIRECTION_ITEMS = [ ('down', "Down", ""),
+                    ('up', "Up", ""),
+                  ]
+OCTAVE_ITEMS = [ ('0', "All", ""),
+                 ('1', "1", ""),
+                 ('2', "2", ""),
+                 ('3', "3", ""),
+                 ('4', "4", ""),
+                 ('5', "5", ""),
+                 ('6', "6", ""),
+                 ('7', "7", ""),
+                 ('8', "8", ""),
+               ]
+
+# Keys with the same value closer than this (in frames) get merged when simplifying.
+# Well below the 1 frame between press and release keys, which float error can make slightly shorter
+KEYFRAME_MERGE_DISTANCE = 0.5
+OUTPUT_TARGET_ITEMS = [
+    ("OBJECTS", "Key Objects", "Animate each key object with its own action"),
+    ("INSTANCES", "Instanced Keyboard", "Animate one keyboard object that instances the keys with geometry nodes"),
+]
+# Node group vectors that get scaled by how far each key instance is pressed
+KEYBOARD_OFFSET_NODES = {"MOVE": "Move Offset", "ROTATE": "Rotate Offset", "SCALE": "Scale Offset"}
+FRAME_RANGE_ITEMS = [
+    ("ALL", "Whole Track", "Generate keys for the whole MIDI track"),
+    ("SCENE", "Scene Range", "Only generate keys between the scene's start and end frame"),
+    ("PREVIEW", "Preview Range", "Only generate keys inside the preview range (or the scene range when it's off)"),
+    ("CUSTOM", "Custom", "Only generate keys between the frames set below"),
+]
+# Note names per pitch class (C = 0) for matching object names to keys
+SHARP_NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+FLAT_NOTE_NAMES = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+# Auto-assign looks for the key's note in the text after the last dot (e.g. "Key.C#4")
+DEFAULT_KEY_NAME_PATTERN = r"[^.]+$"
+JUMP_CHORD_TARGET_ITEMS = [
+    ("CENTER", "Center", "Land in the middle of the chord's keys"),
+    ("LOWEST", "Lowest Note", "Land on the chord's lowest note"),
+    ("HIGHEST", "Highest Note", "Land on the chord's highest note"),
+]
+JUMP_HEIGHT_ITEMS = [
+    ("FIXED", "Fixed", "Every jump uses the travel distance as its height"),
+    ("DISTANCE", "Distance", "Longer jumps go higher (travel distance + scale x distance)"),
+    ("TIME", "Time", "Jumps with more time between notes go higher (travel distance + scale x seconds)"),
+]
+# Notes starting closer than this (in frames) are one chord, the jump object lands once per chord
+CHORD_FRAME_DISTANCE = 1.0
+CONTROLLER_ITEMS = [
+    ("64", "Sustain Pedal (CC64)", ""),
+    ("1", "Mod Wheel (CC1)", ""),
+    ("11", "Expression (CC11)", ""),
+    ("7", "Volume (CC7)", ""),
+    ("PITCH_BEND", "Pitch Bend", "Pitch bend, centered at the middle of the value range"),
+    ("CUSTOM", "Other CC", "Any control change number"),
+]
+# Action property listing the F-curves we generated, as JSON [[data path, array index], ...]
+GENERATED_CHANNELS_PROPERTY = "midi_keyframes_channels"
+# `bpy.data` collection of each ID type we look up by name
+ID_COLLECTIONS = {"OBJECT": "objects", "NODETREE": "node_groups"}
 
 # Global state
-midi_file_loaded = ""
 selected_tracks_raw = []
+# Progress of the running background generation (None when nothing is running)
+generation_progress = None
+# Scene name -> (settings it was built with, LivePlayback) for scenes in live playback mode
+live_playbacks = {}
+# Report of the last profiled generation, shown in the panel
+last_generation_report = None
 
 def handle_midi_file_path(midi_file_path):
     fixed_midi_file_path = midi_file_path
@@ -54,8 +151,14 @@ def handle_midi_file_path(midi_file_path):
 # ------------------------------------------------------------------------
 
 
+def update_live_playback(self, context):
+    if self.live_playback:
+        live_playback_handler(context.scene)
+    else:
+        stop_live_playback(context.scene)
+
 def selected_track_enum_callback(scene, context):
-    global midi_file_loaded, selected_tracks_raw
+    global selected_tracks_raw
 
     midi_keyframe_props = context.scene.midi_keyframe_props
     midi_file_path = midi_keyframe_props.midi_file
@@ -63,38 +166,13 @@ def selected_track_enum_callback(scene, context):
     if not has_valid_midi_file(context):
         return []
 
-    # Have we already scanned this file? Check the "cache"
-    if midi_file_loaded == midi_file_path:
-        return selected_tracks_raw
-
-    # Import the MIDI file
-    from mido import MidiFile
-
-    fixed_path = handle_midi_file_path(midi_file_path)
-    mid = MidiFile(fixed_path)
-
-    # Setup time for track
-    selected_tracks_raw = []
-    time = 0
-    # current_frame = context.scene.frame_current
-    scene_start_frame = context.scene.frame_start
-    scene_end_frame = context.scene.frame_end
-    total_frames = scene_end_frame - scene_start_frame
-    
-
-    # Determine active track
-    for i, track in enumerate(mid.tracks):
-        # Loop over each note in the track
-        for msg in track:
-            if not msg.is_meta:
-                # add to list of tracks
-                selected_tracks_raw.insert(len(selected_tracks_raw), ("{}".format(i), "Track {} {}".format(i, track.name), ""))
-                break;
-
-    # print(selected_tracks_raw)
+    # Parsed files are cached and re-parsed only if the file changes on disk
+    cached_file = midi_file_cache.get(midi_file_path)
+    if cached_file is None:
+        return []
 
-    # Mark this MIDI file as "cached"
-    midi_file_loaded = midi_file_path
+    # Blender needs us to keep a reference to the enum items around
+    selected_tracks_raw = cached_file.get_track_items()
     
     return selected_tracks_raw
 
@@ -109,6 +187,12 @@ class KeyItem(PropertyGroup):
         description="Reference to the key 3d object",
         type=bpy.types.Object,
     )
+    instance_index: IntProperty(
+        name="Instance Index",
+        description="Which instance of the instanced keyboard plays this note (-1 = none)",
+        default=-1,
+        min=-1,
+    )
 
 class KeyList(bpy.types.UIList):
     bl_label = "UIList for Keymapping"
@@ -121,11 +205,133 @@ class KeyList(bpy.types.UIList):
         if self.layout_type in {'DEFAULT', 'COMPACT'}:
             row = layout.row()
             row.label(text=item.name)
-            row.prop(item, "obj", text="")
+            if data.output_target == "INSTANCES":
+                row.prop(item, "instance_index", text="")
+            else:
+                row.prop(item, "obj", text="")
         elif self.layout_type == 'GRID':
             layout.alignment = 'CENTER'
             layout.prop(item.obj)
 
+# Track to animate in batch mode, with its own keys and settings
+class TrackTarget(PropertyGroup):
+    track: EnumProperty(
+        name="Track",
+        description="The track you want copied to animation frames",
+        items=selected_track_enum_callback
+        )
+    collection: PointerProperty(
+        name="Key Collection",
+        description="Collection with the key objects for this track (uses the piano key list if empty)",
+        type=bpy.types.Collection,
+        )
+    scene: PointerProperty(
+        name="Scene",
+        description="Scene this target gets animated for, uses its frame rate, speed, frame range and piano key list (the current scene if empty)",
+        type=bpy.types.Scene,
+        )
+    travel_distance: FloatProperty(
+        name = "Travel Distance",
+        description = "How far key moves when 'pressed'",
+        default = 1.0,
+        min = 0.01,
+        max = 100.0
+        )
+    animation_type: EnumProperty(
+        name="Object Animation",
+        description="Changes what animates about object (e.g. Move is up and down)",
+        items=ANIMATION_TYPE_ITEMS
+        )
+    axis: EnumProperty(
+        name="Axis",
+        description="Axis that gets animated, aka direction piano keys move",
+        items=AXIS_ITEMS
+        )
+    direction: EnumProperty(
+        name = "Direction",
+        description = "Do the objects move up or down?",
+        items=DIRECTION_ITEMS
+        )
+    octave: EnumProperty(
+        name = "Octave",
+        description = "Which octave should we use? (e.g. 3 = C3, D3, etc)",
+        items=OCTAVE_ITEMS
+        )
+
+class TrackTargetList(bpy.types.UIList):
+    bl_label = "UIList for Track Targets"
+    bl_idname = "TrackTargetList"
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        if self.layout_type in {'DEFAULT', 'COMPACT'}:
+            row = layout.row()
+            row.prop(item, "track", text="")
+            row.prop(item, "collection", text="")
+        elif self.layout_type == 'GRID':
+            layout.alignment = 'CENTER'
+            layout.prop(item, "track", text="")
+
+# Controller stream that drives an object property
+class ControllerTarget(PropertyGroup):
+    controller: EnumProperty(
+        name="Controller",
+        description="Control change or pitch bend to bake into keyframes",
+        items=CONTROLLER_ITEMS,
+        )
+    cc_number: IntProperty(
+        name="CC Number",
+        description="Control change number",
+        default=0,
+        min=0,
+        max=127,
+        )
+    channel: IntProperty(
+        name="Channel",
+        description="MIDI channel to read (0 = all channels)",
+        default=0,
+        min=0,
+        max=16,
+        )
+    obj: PointerProperty(
+        name="Object",
+        description="Object with the property to animate",
+        type=bpy.types.Object,
+        )
+    data_path: StringProperty(
+        name="Data Path",
+        description="Property to animate (e.g. location, or [\"prop\"] for a custom property)",
+        default="location",
+        )
+    array_index: IntProperty(
+        name="Index",
+        description="Which value of an array property to animate (e.g. 2 = Z for location)",
+        default=0,
+        min=0,
+        )
+    min_value: FloatProperty(
+        name="Min",
+        description="Property value when the controller is at 0",
+        default=0.0,
+        )
+    max_value: FloatProperty(
+        name="Max",
+        description="Property value when the controller is at its maximum",
+        default=1.0,
+        )
+
+class ControllerTargetList(bpy.types.UIList):
+    bl_label = "UIList for Controller Targets"
+    bl_idname = "ControllerTargetList"
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        if self.layout_type in {'DEFAULT', 'COMPACT'}:
+            row = layout.row()
+            row.prop(item, "controller", text="")
+            row.prop(item, "obj", text="")
+        elif self.layout_type == 'GRID':
+            layout.alignment = 'CENTER'
+            layout.prop(item, "controller", text="")
+
 # UI properties
 class GI_SceneProperties(PropertyGroup):
         
@@ -155,39 +361,22 @@ class GI_SceneProperties(PropertyGroup):
     animation_type: EnumProperty(
         name="Object Animation",
         description="Changes what animates about object (e.g. Move is up and down)",
-        items=[ ('MOVE', "Move", ""),
-                ('SCALE', "Scale", ""),
-                ('ROTATE', "Rotate", ""),
-              ]
+        items=ANIMATION_TYPE_ITEMS
         )
     axis: EnumProperty(
         name="Axis",
         description="Axis that gets animated, aka direction piano keys move",
-        items=[ ('0', "X", ""),
-                ('1', "Y", ""),
-                ('2', "Z", ""),
-              ]
+        items=AXIS_ITEMS
         )
     direction: EnumProperty(
         name = "Direction",
         description = "Do the objects move up or down?",
-        items=[ ('down', "Down", ""),
-                ('up', "Up", ""),
-              ]
+        items=DIRECTION_ITEMS
         )
     octave: EnumProperty(
         name = "Octave",
         description = "Which octave should we use? (e.g. 3 = C3, D3, etc)",
-        items=[ ('0', "All", ""),
-                ('1', "1", ""),
-                ('2', "2", ""),
-                ('3', "3", ""),
-                ('4', "4", ""),
-                ('5', "5", ""),
-                ('6', "6", ""),
-                ('7', "7", ""),
-                ('8', "8", ""),
-              ]
+        items=OCTAVE_ITEMS
         )
     speed: FloatProperty(
             name = "Speed",
@@ -196,6 +385,87 @@ class GI_SceneProperties(PropertyGroup):
             min = 0.01,
             max = 100.0
         )
+    simplify_keyframes: BoolProperty(
+        name = "Simplify Keyframes",
+        description = "Merges keys less than a frame apart and removes keys that don't change the animation",
+        default = True
+        )
+    simplify_tolerance: FloatProperty(
+        name = "Simplify Tolerance",
+        description = "How far a key can be from the line between its neighbors and still get removed",
+        default = 0.0001,
+        min = 0.0,
+        max = 1.0,
+        precision = 4
+        )
+    output_target: EnumProperty(
+        name = "Output",
+        description = "What gets animated for each key",
+        items=OUTPUT_TARGET_ITEMS
+        )
+    keyboard_obj: PointerProperty(
+        name="Instanced Keyboard",
+        description="Keyboard object created by 'Create Instanced Keyboard'",
+        type=bpy.types.Object,
+    )
+    live_playback: BoolProperty(
+        name = "Live Playback",
+        description = "Poses keys straight from the MIDI file on every frame change instead of using keyframes",
+        default = False,
+        update=update_live_playback
+        )
+    frame_range: EnumProperty(
+        name = "Frame Range",
+        description = "Which frames get keys, keys outside the range are left alone",
+        items=FRAME_RANGE_ITEMS
+        )
+    frame_range_start: IntProperty(
+        name = "Start Frame",
+        description = "First frame that gets keys",
+        default = 1
+        )
+    frame_range_end: IntProperty(
+        name = "End Frame",
+        description = "Last frame that gets keys",
+        default = 250
+        )
+    incremental_generation: BoolProperty(
+        name = "Only Rebuild Changes",
+        description = "Regenerates only keys whose MIDI notes, object or settings changed since the last generation",
+        default = True
+        )
+    time_budget: FloatProperty(
+        name = "Time Budget (ms)",
+        description = "How long generating keyframes can block Blender on each update",
+        default = 20.0,
+        min = 1.0,
+        max = 1000.0
+        )
+    profile_generation: BoolProperty(
+        name = "Profile Generation",
+        description = "Measures time, counts and peak memory of each generation stage (also on with the MIDI_KEYFRAMES_PROFILE environment variable)",
+        default = False
+        )
+    profile_cprofile: BoolProperty(
+        name = "Capture cProfile",
+        description = "Also records a function level profile of the generation and prints the slowest functions",
+        default = False
+        )
+    profile_report_path: StringProperty(
+        name = "Profile Report",
+        description = "JSON file the profile report gets saved to (optional)",
+        subtype = 'FILE_PATH'
+        )
+    use_timeline_cache: BoolProperty(
+        name = "Cache Timelines on Disk",
+        description = "Saves parsed MIDI tracks next to the .blend file so they load instantly next time",
+        default = False
+        )
+    timeline_cache_dir: StringProperty(
+        name = "Cache Folder",
+        description = "Folder for cached MIDI timelines (defaults to 'midi_cache' next to the .blend file)",
+        subtype = 'DIR_PATH'
+        )
 
     # MIDI Keys
     obj_jump: PointerProperty(
@@ -203,6 +473,36 @@ class GI_SceneProperties(PropertyGroup):
         description="Object that 'jumps' between key objects",
         type=bpy.types.Object,
         )
+    jump_chord_target: EnumProperty(
+        name="Chord Landing",
+        description="Where the jumping object lands when several notes start at once",
+        items=JUMP_CHORD_TARGET_ITEMS,
+        default="CENTER",
+        )
+    jump_height_mode: EnumProperty(
+        name="Jump Height",
+        description="How high each jump goes",
+        items=JUMP_HEIGHT_ITEMS,
+        default="FIXED",
+        )
+    jump_height_scale: FloatProperty(
+        name="Height Scale",
+        description="Extra height per unit of distance or second between notes",
+        default=0.5,
+        min=0.0,
+        max=100.0,
+        )
+
+    key_name_pattern: StringProperty(
+        name="Key Name Pattern",
+        description="Regular expression that finds the note in object names (C4, Db4, C#4 or the MIDI number), uses the \"note\" group or the first group if there is one",
+        default=DEFAULT_KEY_NAME_PATTERN,
+        )
+    key_search_children: BoolProperty(
+        name="Search Child Collections",
+        description="Also look for key objects in collections inside the selected collection",
+        default=True,
+        )
 
     keys: CollectionProperty(
         name="Key Object List",
@@ -215,9 +515,44 @@ class GI_SceneProperties(PropertyGroup):
         name="Selected Key ID",
         description="ID of selected key list item",
     )
-    
+
     # App State (not for user)
-    initial_state = {}
+    generation_fingerprint: StringProperty(
+        name="Generation Fingerprint",
+        description="Inputs of the last piano key generation, used to only rebuild what changed",
+        options={'HIDDEN'},
+    )
+
+    # Batch mode
+    track_targets: CollectionProperty(
+        name="Track Targets",
+        description="Tracks to animate together, each with its own keys and settings",
+        type=TrackTarget,
+    )
+
+    selected_track_target: IntProperty(
+        name="Selected Track Target ID",
+        description="ID of selected track target list item",
+    )
+
+    # Controllers
+    controller_targets: CollectionProperty(
+        name="Controller Targets",
+        description="Control changes and pitch bend of the selected track baked into object properties",
+        type=ControllerTarget,
+    )
+    selected_controller_target: IntProperty(
+        name="Selected Controller Target ID",
+        description="ID of selected controller target list item",
+    )
+    controller_tolerance: FloatProperty(
+        name="Controller Tolerance",
+        description="How far (in property units) the baked curve can be from the controller before a key is kept",
+        default=0.005,
+        min=0.0,
+        max=10.0,
+        precision=4,
+    )
 
 # UI Panel
 class GI_GamepadInputPanel(bpy.types.Panel):
@@ -242,6 +577,9 @@ class GI_GamepadInputPanel(bpy.types.Panel):
         layout.prop(midi_keyframe_props, "midi_file")
         layout.prop(midi_keyframe_props, "selected_track")
         layout.prop(midi_keyframe_props, "octave")
+        layout.prop(midi_keyframe_props, "use_timeline_cache")
+        if midi_keyframe_props.use_timeline_cache:
+            layout.prop(midi_keyframe_props, "timeline_cache_dir")
 
         layout.separator(factor=1.5)
         layout.label(text="Animation Settings", icon="IPO_ELASTIC")
@@ -253,21 +591,95 @@ class GI_GamepadInputPanel(bpy.types.Panel):
         layout.prop(midi_keyframe_props, "animation_type")
         layout.prop(midi_keyframe_props, "direction")
         layout.prop(midi_keyframe_props, "speed")
+        layout.prop(midi_keyframe_props, "simplify_keyframes")
+        if midi_keyframe_props.simplify_keyframes:
+            layout.prop(midi_keyframe_props, "simplify_tolerance")
 
         layout.separator(factor=1.5)
         layout.label(text="Generate Animation", icon="RENDER_ANIMATION")
+        layout.prop(midi_keyframe_props, "output_target")
+        if midi_keyframe_props.output_target == "INSTANCES":
+            layout.prop(midi_keyframe_props, "keyboard_obj")
+            layout.operator("wm.create_instanced_keyboard")
         layout.operator("wm.generate_piano_animation")
         layout.operator("wm.generate_jumping_animation")
+        layout.prop(midi_keyframe_props, "live_playback")
+        if midi_keyframe_props.live_playback:
+            layout.operator("wm.bake_live_playback")
+        if generation_progress is not None:
+            layout.progress(factor=generation_progress, type="BAR", text="Generating keyframes (ESC to cancel)")
+        layout.prop(midi_keyframe_props, "frame_range")
+        if midi_keyframe_props.frame_range == "CUSTOM":
+            row = layout.row(align=True)
+            row.prop(midi_keyframe_props, "frame_range_start")
+            row.prop(midi_keyframe_props, "frame_range_end")
+        if midi_keyframe_props.frame_range == "ALL":
+            layout.prop(midi_keyframe_props, "incremental_generation")
+        layout.prop(midi_keyframe_props, "time_budget")
+
+        layout.prop(midi_keyframe_props, "profile_generation")
+        if midi_keyframe_props.profile_generation:
+            layout.prop(midi_keyframe_props, "profile_cprofile")
+            layout.prop(midi_keyframe_props, "profile_report_path")
+        if last_generation_report is not None:
+            box = layout.box()
+            box.label(text="Last run: {:.1f} ms, {:.1f} MB peak".format(last_generation_report["total_seconds"] * 1000, last_generation_report["peak_memory"] / 1024 / 1024))
+            for stage_name, stage in last_generation_report["stages"].items():
+                box.label(text=format_profile_stage(stage_name, stage))
 
         layout.separator(factor=1.5)
         layout.label(text="Piano Keys", icon="OBJECT_DATAMODE")
+        layout.prop(midi_keyframe_props, "key_name_pattern")
+        layout.prop(midi_keyframe_props, "key_search_children")
         layout.operator("wm.assign_keys")
         layout.operator("wm.initialise_key_list")
         layout.template_list("KeyList", "key-list", midi_keyframe_props, "keys", midi_keyframe_props, "selected_key")
 
+        layout.separator(factor=1.5)
+        layout.label(text="Track Targets", icon="NLA")
+        row = layout.row()
+        row.template_list("TrackTargetList", "track-target-list", midi_keyframe_props, "track_targets", midi_keyframe_props, "selected_track_target")
+        column = row.column(align=True)
+        column.operator("wm.add_track_target", icon="ADD", text="")
+        column.operator("wm.remove_track_target", icon="REMOVE", text="")
+        if 0 <= midi_keyframe_props.selected_track_target < len(midi_keyframe_props.track_targets):
+            track_target = midi_keyframe_props.track_targets[midi_keyframe_props.selected_track_target]
+            layout.prop(track_target, "scene")
+            layout.prop(track_target, "octave")
+            if track_target.animation_type != "SCALE":
+                layout.prop(track_target, "axis")
+            layout.prop(track_target, "travel_distance")
+            layout.prop(track_target, "animation_type")
+            layout.prop(track_target, "direction")
+        layout.operator("wm.generate_batch_animation")
+
+        layout.separator(factor=1.5)
+        layout.label(text="Controllers", icon="FORCE_HARMONIC")
+        row = layout.row()
+        row.template_list("ControllerTargetList", "controller-target-list", midi_keyframe_props, "controller_targets", midi_keyframe_props, "selected_controller_target")
+        column = row.column(align=True)
+        column.operator("wm.add_controller_target", icon="ADD", text="")
+        column.operator("wm.remove_controller_target", icon="REMOVE", text="")
+        if 0 <= midi_keyframe_props.selected_controller_target < len(midi_keyframe_props.controller_targets):
+            controller_target = midi_keyframe_props.controller_targets[midi_keyframe_props.selected_controller_target]
+            if controller_target.controller == "CUSTOM":
+                layout.prop(controller_target, "cc_number")
+            layout.prop(controller_target, "channel")
+            layout.prop(controller_target, "data_path")
+            layout.prop(controller_target, "array_index")
+            row = layout.row()
+            row.prop(controller_target, "min_value")
+            row.prop(controller_target, "max_value")
+        layout.prop(midi_keyframe_props, "controller_tolerance")
+        layout.operator("wm.generate_controller_animation")
+
         layout.separator(factor=1.5)
         layout.label(text="Other Objects", icon="OBJECT_HIDDEN")
         layout.prop(midi_keyframe_props, "obj_jump", icon="MATSPHERE")
+        layout.prop(midi_keyframe_props, "jump_chord_target")
+        layout.prop(midi_keyframe_props, "jump_height_mode")
+        if midi_keyframe_props.jump_height_mode != "FIXED":
+            layout.prop(midi_keyframe_props, "jump_height_scale")
 
         layout.separator(factor=4.2)
         layout.label(text="Danger Zone", icon="ERROR")
@@ -293,13 +705,6 @@ class GI_install_midi(bpy.types.Operator):
         return {"FINISHED"}
     
 # Shared helper functions
-def get_note_key(midi_keyframe_props, midi_note):
-    keys = midi_keyframe_props.keys
-    if len(keys) > midi_note - 21:
-        note_key = keys[midi_note - 21]
-        return note_key
-    return None
-
 def has_valid_midi_file(context) -> bool:
         midi_keyframe_props = context.scene.midi_keyframe_props
         midi_file_path = midi_keyframe_props.midi_file
@@ -311,159 +716,1526 @@ def has_valid_midi_file(context) -> bool:
             return False
         return True
 
-def get_note_octave(midi_note):
-    octave = round(midi_note / 12)
-    return octave
+def get_frame_range(context):
+    return get_scene_frame_range(context.scene)
+
+def get_scene_frame_range(scene):
+    # (first frame, last frame) to generate keys for, None for the whole track
+    midi_keyframe_props = scene.midi_keyframe_props
+    if midi_keyframe_props.frame_range == "PREVIEW" and scene.use_preview_range:
+        return (scene.frame_preview_start, scene.frame_preview_end)
+    if midi_keyframe_props.frame_range in ("SCENE", "PREVIEW"):
+        return (scene.frame_start, scene.frame_end)
+    if midi_keyframe_props.frame_range == "CUSTOM":
+        return (midi_keyframe_props.frame_range_start, max(midi_keyframe_props.frame_range_start, midi_keyframe_props.frame_range_end))
+    return None
 
-class ParsedMidiFile:
-    total_time = 0
-    midi = None
-    has_release = False
-    tempo = DEFAULT_TEMPO
-    selected_track = 0
+def get_timeline_cache_dir(midi_keyframe_props):
+    if not midi_keyframe_props.use_timeline_cache:
+        return None
+    if midi_keyframe_props.timeline_cache_dir != "":
+        return handle_midi_file_path(midi_keyframe_props.timeline_cache_dir)
+    # Unsaved .blend files don't have a folder we can put the cache in
+    if bpy.data.filepath == "":
+        return None
+    return handle_midi_file_path("//midi_cache")
+
+def get_keyboard_value_node_name(instance_index):
+    return "Key {}".format(instance_index)
+
+def get_keyboard_node_group(keyboard_obj):
+    for modifier in keyboard_obj.modifiers:
+        if modifier.type == 'NODES' and modifier.node_group is not None:
+            return modifier.node_group
+    return None
 
-    def __init__(self, midi_file_path, selected_track) -> None:
-        print("Loading MIDI file...") 
-        self.selected_track = selected_track
-        from mido import MidiFile
+def build_keyboard_node_group(name, collection, instance_count):
+    # Instances every object in the collection and offsets each instance by how far its key is pressed
+    node_tree = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    node_tree.interface.new_socket(name="Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+    nodes = node_tree.nodes
+    links = node_tree.links
+
+    # One instance per object, in name order
+    collection_info = nodes.new('GeometryNodeCollectionInfo')
+    collection_info.transform_space = 'RELATIVE'
+    collection_info.inputs["Collection"].default_value = collection
+    collection_info.inputs["Separate Children"].default_value = True
+
+    # Press amount of each instance, these values are what gets keyframed
+    index_switch = nodes.new('GeometryNodeIndexSwitch')
+    index_switch.data_type = 'FLOAT'
+    while len(index_switch.index_switch_items) < instance_count:
+        index_switch.index_switch_items.new()
+    links.new(nodes.new('GeometryNodeInputIndex').outputs[0], index_switch.inputs[0])
+    for instance_index in range(instance_count):
+        value_node = nodes.new('ShaderNodeValue')
+        value_node.name = get_keyboard_value_node_name(instance_index)
+        value_node.label = value_node.name
+        value_node.outputs[0].default_value = 0.0
+        links.new(value_node.outputs[0], index_switch.inputs[instance_index + 1])
+    press_amount = index_switch.outputs[0]
+
+    def scale_offset(node_name):
+        offset_node = nodes.new('FunctionNodeInputVector')
+        offset_node.name = node_name
+        offset_node.label = node_name
+        scale_node = nodes.new('ShaderNodeVectorMath')
+        scale_node.operation = 'SCALE'
+        links.new(offset_node.outputs[0], scale_node.inputs[0])
+        links.new(press_amount, scale_node.inputs["Scale"])
+        return scale_node.outputs[0]
+
+    translate = nodes.new('GeometryNodeTranslateInstances')
+    links.new(collection_info.outputs[0], translate.inputs["Instances"])
+    links.new(scale_offset(KEYBOARD_OFFSET_NODES["MOVE"]), translate.inputs["Translation"])
+
+    rotate = nodes.new('GeometryNodeRotateInstances')
+    links.new(translate.outputs[0], rotate.inputs["Instances"])
+    links.new(scale_offset(KEYBOARD_OFFSET_NODES["ROTATE"]), rotate.inputs["Rotation"])
+
+    # Scale starts at 1 and grows with the press
+    scale_add = nodes.new('ShaderNodeVectorMath')
+    scale_add.operation = 'ADD'
+    scale_add.inputs[1].default_value = (1.0, 1.0, 1.0)
+    links.new(scale_offset(KEYBOARD_OFFSET_NODES["SCALE"]), scale_add.inputs[0])
+    scale = nodes.new('GeometryNodeScaleInstances')
+    links.new(rotate.outputs[0], scale.inputs["Instances"])
+    links.new(scale_add.outputs[0], scale.inputs["Scale"])
+
+    links.new(scale.outputs[0], nodes.new('NodeGroupOutput').inputs[0])
+    return node_tree
+
+def update_keyboard_offsets(node_tree, settings):
+    # Only the offset for the current animation type moves the instances
+    direction_factor = -1 if settings.direction == "down" else 1
+    offsets = {animation_type: [0.0, 0.0, 0.0] for animation_type in KEYBOARD_OFFSET_NODES}
+    offsets["MOVE"][int(settings.axis)] = settings.travel_distance * direction_factor
+    offsets["ROTATE"][int(settings.axis)] = math.radians(settings.travel_distance * direction_factor)
+    offsets["SCALE"] = [settings.travel_distance] * 3
+    for animation_type, node_name in KEYBOARD_OFFSET_NODES.items():
+        offset_node = node_tree.nodes.get(node_name)
+        if offset_node is not None:
+            offset_node.vector = offsets[animation_type] if animation_type == settings.animation_type else (0.0, 0.0, 0.0)
+
+# Finds objects named after a key (e.g. "Key.C4") and returns them by key index
+def get_key_aliases(key_name, midi_note):
+    """Names that match a key: its own names plus "C#4", "Db4", "C#", "Db" and "61" spellings (case insensitive)"""
+    pitch_class = midi_note % 12
+    octave = midi_note // 12 - 1
+    aliases = set(key_name.split("/"))
+    aliases.add(str(midi_note))
+    for note_name in (SHARP_NOTE_NAMES[pitch_class], FLAT_NOTE_NAMES[pitch_class]):
+        aliases.add(note_name)
+        aliases.add("{}{}".format(note_name, octave))
+    return {alias.casefold() for alias in aliases if alias != ""}
+
+def build_key_alias_index(keys):
+    # alias -> indices of the keys it matches, names without an octave match every octave
+    alias_index = {}
+    for index, key in enumerate(keys):
+        # The key list starts at A0 (MIDI note 21)
+        for alias in get_key_aliases(key.name, index + 21):
+            alias_index.setdefault(alias, []).append(index)
+    return alias_index
+
+def find_key_objects(collection, keys, name_pattern=DEFAULT_KEY_NAME_PATTERN, recursive=True, report=None):
+    """Finds the key object for each key by the note name in the object names, returns { key index: object }
+
+    `name_pattern` is a regex that finds the note name in an object name (the "note" group, the first group
+    or the whole match). Objects get looked up by alias in one pass, so big collections are fine.
+    Pass a dict as `report` to get the "unmatched" and "ambiguous" object names and the key indices
+    that have "duplicate" objects (the first object by name gets the key).
+    """
+    pattern = re.compile(name_pattern) if isinstance(name_pattern, str) else name_pattern
+    note_group = "note" if "note" in pattern.groupindex else (1 if pattern.groups > 0 else 0)
+    alias_index = build_key_alias_index(keys)
+
+    key_objects = {}
+    unmatched = []
+    ambiguous = []
+    duplicates = {}
+    objects = collection.all_objects if recursive else collection.objects
+    for check_obj in sorted(objects, key=lambda obj: obj.name):
+        match = pattern.search(check_obj.name)
+        note_name = match.group(note_group) if match is not None else None
+        indices = alias_index.get(note_name.casefold(), ()) if note_name else ()
+        if len(indices) == 0:
+            unmatched.append(check_obj.name)
+        elif len(indices) > 1:
+            ambiguous.append(check_obj.name)
+        elif indices[0] in key_objects:
+            duplicates.setdefault(indices[0], [key_objects[indices[0]].name]).append(check_obj.name)
+        else:
+            key_objects[indices[0]] = check_obj
+
+    if report is not None:
+        report.update(unmatched=unmatched, ambiguous=ambiguous, duplicates=duplicates)
+    return key_objects
+
+def report_removed_keyframes(operator, keyframe_writer):
+    if keyframe_writer.simplify_tolerance is not None:
+        operator.report({"INFO"}, "Simplifying removed {} redundant keyframes".format(keyframe_writer.removed_count))
+
+def tag_redraw_panels(context):
+    for area in context.screen.areas:
+        if area.type == 'VIEW_3D':
+            area.tag_redraw()
+
+# Inserts a keyframe directly or queues it on a writer for bulk insertion
+def set_property_values(obj, data_path, values):
+    # Nested paths (e.g. 'nodes["Key 0"].outputs[0].default_value') get resolved to the struct that owns the property
+    owner_path, _, property_name = data_path.rpartition(".")
+    owner = obj.path_resolve(owner_path) if owner_path != "" else obj
+    setattr(owner, property_name, values if len(values) > 1 else values[0])
+
+def insert_keyframe(keyframe_writer, obj, data_path, frame, values, priority=0):
+    if keyframe_writer is None:
+        set_property_values(obj, data_path, values)
+        obj.keyframe_insert(data_path=data_path, frame=frame)
+        return
+    keyframe_writer.insert(obj, data_path, frame, values, priority)
+
+def simplify_keyframes(keys, tolerance):
+    """Merges keys with the same value less than half a frame apart and drops keys on the line between their neighbors
+
+    `keys` maps frame -> (value, priority), returns a sorted list of (frame, value).
+    """
+    # Merge coincident keys, the key with the highest priority wins (the later one on a tie).
+    # Keys with different values never merge, so a release can't get swallowed by the hold before it
+    merged = []
+    cluster_start = None
+    for frame in sorted(keys):
+        value, priority = keys[frame]
+        if merged and frame - cluster_start < KEYFRAME_MERGE_DISTANCE and value == merged[-1][1]:
+            if priority >= merged[-1][2]:
+                merged[-1] = (frame, value, priority)
+            continue
+        cluster_start = frame
+        merged.append((frame, value, priority))
+
+    # Drop keys that are (almost) on the line between the last kept key and the next key,
+    # this also removes every key in the middle of a flat run
+    simplified = merged[:1]
+    for i in range(1, len(merged) - 1):
+        prev_frame, prev_value, prev_priority = simplified[-1]
+        frame, value, priority = merged[i]
+        next_frame, next_value, next_priority = merged[i + 1]
+        expected_value = prev_value + (next_value - prev_value) * (frame - prev_frame) / (next_frame - prev_frame)
+        if abs(value - expected_value) > tolerance:
+            simplified.append(merged[i])
+    if len(merged) > 1:
+        simplified.append(merged[-1])
+
+    return [(frame, value) for frame, value, priority in simplified]
+
+def decimate_keyframes(first_frame, values, tolerance):
+    """Ramer-Douglas-Peucker on keys at every frame, returns the (frame, value) keys to keep
+
+    Keys get dropped while the line between the kept ones stays within `tolerance` of every value.
+    """
+    if len(values) < 3:
+        return [(first_frame + index, value) for index, value in enumerate(values)]
+    keep = bytearray(len(values))
+    keep[0] = keep[-1] = 1
+    # Walks the segments with a stack instead of recursion, dense curves would hit the recursion limit
+    segments = [(0, len(values) - 1)]
+    while segments:
+        start, end = segments.pop()
+        start_value = values[start]
+        slope = (values[end] - start_value) / (end - start)
+        max_distance = tolerance
+        max_index = None
+        for index in range(start + 1, end):
+            distance = abs(values[index] - (start_value + slope * (index - start)))
+            if distance > max_distance:
+                max_distance = distance
+                max_index = index
+        if max_index is not None:
+            keep[max_index] = 1
+            segments.append((start, max_index))
+            segments.append((max_index, end))
+    return [(first_frame + index, values[index]) for index in itertools.compress(range(len(values)), keep)]
+
+def get_generated_channels(action):
+    return {(data_path, index) for data_path, index in json.loads(action.get(GENERATED_CHANNELS_PROPERTY, "[]"))}
+
+def set_generated_channels(action, channels):
+    action[GENERATED_CHANNELS_PROPERTY] = json.dumps(sorted(channels))
+
+def get_rest_values(obj, data_path):
+    """Values of a property before the keys we generated, so regenerating doesn't start from an animated pose
+
+    The live property is whatever the animation set for the current frame. Channels we generated start at rest,
+    so their first key is used instead, the live value only for channels we didn't generate.
+    """
+    values = list(getattr(obj, data_path))
+    animation_data = obj.animation_data
+    if animation_data is None or animation_data.action is None:
+        return values
+    channels = get_generated_channels(animation_data.action)
+    for index in range(len(values)):
+        fcurve = animation_data.action.fcurves.find(data_path, index=index)
+        if fcurve is not None and (data_path, index) in channels and len(fcurve.keyframe_points) > 0:
+            values[index] = fcurve.keyframe_points[0].co[1]
+    return values
+
+def remove_keyframes_in_range(fcurve, frame_range):
+    # Reads every key at once and writes back the ones outside of the range, returns how many got removed
+    keyframe_points = fcurve.keyframe_points
+    coords = [0.0] * (len(keyframe_points) * 2)
+    keyframe_points.foreach_get("co", coords)
+    first_frame, last_frame = frame_range
+    kept_coords = []
+    for i in range(0, len(coords), 2):
+        if not first_frame <= coords[i] <= last_frame:
+            kept_coords.append(coords[i])
+            kept_coords.append(coords[i + 1])
+    removed_count = (len(coords) - len(kept_coords)) // 2
+    if removed_count > 0:
+        keyframe_points.clear()
+        keyframe_points.add(len(kept_coords) // 2)
+        keyframe_points.foreach_set("co", kept_coords)
+        fcurve.update()
+    return removed_count
+
+def remove_generated_keyframes(id_data, data_paths=None, frame_range=None, array_index=None):
+    """Removes the F-curves we generated on an object or node tree, everything else on it is left alone
+
+    Only channels with one of `data_paths` (and `array_index` if set) get removed, all of them when None.
+    With a frame range only the keys inside it get removed and the F-curves stay. Returns the number of removed keys.
+    """
+    animation_data = id_data.animation_data
+    if animation_data is None or animation_data.action is None:
+        return 0
+    action = animation_data.action
+    channels = get_generated_channels(action)
+    removed_count = 0
+    for fcurve in list(action.fcurves):
+        channel = (fcurve.data_path, fcurve.array_index)
+        if channel not in channels or (data_paths is not None and fcurve.data_path not in data_paths):
+            continue
+        if array_index is not None and fcurve.array_index != array_index:
+            continue
+        if frame_range is not None:
+            removed_count += remove_keyframes_in_range(fcurve, frame_range)
+            continue
+        removed_count += len(fcurve.keyframe_points)
+        action.fcurves.remove(fcurve)
+        channels.discard(channel)
+    set_generated_channels(action, channels)
+    return removed_count
+
+def format_profile_stage(stage_name, stage):
+    counts = ", ".join("{} {}".format(value, name.replace("_", " ")) for name, value in stage.items() if name not in ("seconds", "peak_memory"))
+    return "{}: {:.1f} ms, {:.1f} MB peak{}".format(stage_name, stage["seconds"] * 1000, stage["peak_memory"] / 1024 / 1024, ", " + counts if counts else "")
+
+def get_octave_skipped_count(midi_file, target):
+    # Notes that have a key but get skipped because they're outside of the selected octave
+    skipped_notes = bytearray(128)
+    if target.octave != 0:
+        for midi_note, move_obj in enumerate(target.note_objects):
+            skipped_notes[midi_note] = move_obj is not None and get_note_octave(midi_note) != target.octave
+    return sum(map(skipped_notes.__getitem__, midi_file.note_spans.notes))
+
+class GenerationProfiler:
+    """Wall time, counts and peak memory of each stage of a generation run (does nothing when disabled)"""
+
+    def __init__(self, name, enabled=False, use_cprofile=False, report_path="") -> None:
+        self.name = name
+        self.enabled = enabled
+        self.report_path = report_path
+        # Stage name -> { "seconds": ..., "peak_memory": ..., other counts }, stages entered again add up
+        self.stages = {}
+        self.profile = cProfile.Profile() if enabled and use_cprofile else None
+        self.start_time = time.perf_counter()
+        self.started_tracemalloc = enabled and not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
 
-        fixed_midi_file_path = handle_midi_file_path(midi_file_path)
+    @classmethod
+    def from_settings(cls, name, settings):
+        # MIDI_KEYFRAMES_PROFILE=1 turns it on for runs without the UI (e.g. on a farm), =cprofile also captures cProfile
+        profile_env = os.environ.get("MIDI_KEYFRAMES_PROFILE", "")
+        return cls(
+            name,
+            enabled=settings.profile_generation or profile_env != "",
+            use_cprofile=settings.profile_cprofile or profile_env == "cprofile",
+            report_path=settings.profile_report_path or os.environ.get("MIDI_KEYFRAMES_PROFILE_REPORT", ""),
+        )
 
-        self.midi = MidiFile(fixed_midi_file_path)
-        
-        # Get tempo from the first track
-        for msg in self.midi.tracks[0]:
-            if msg.is_meta and msg.type == 'set_tempo':
-                self.tempo = msg.tempo
-
-        # Total time
-        for msg in self.midi.tracks[int(selected_track)]:
-            
-            # Figure out total time
-            # We basically loop over every note in the selected track
-            # and add up the time!
-            self.total_time += msg.time
-
-            # We also see if there's any stopping points using `note_off`
-            # If missing - we assume notes are held for 1 second (like 1 block in FLStudio)
-            if msg.type == 'note_off':
-                self.has_release = True
-
-    def for_each_key(self, context, key_callback):
-        from mido import tick2second
-
-        scene_start_frame = context.scene.frame_start
-        scene_end_frame = context.scene.frame_end
-        total_frames = scene_end_frame - scene_start_frame
-        fps = context.scene.render.fps
-        time = 0
-        midi_keyframe_props = context.scene.midi_keyframe_props
-        speed = midi_keyframe_props.speed
+    def get_stage(self, stage_name):
+        return self.stages.setdefault(stage_name, {"seconds": 0.0, "peak_memory": 0})
+
+    @contextlib.contextmanager
+    def stage(self, stage_name):
+        if not self.enabled:
+            yield
+            return
+
+        # cProfile only follows the thread it's enabled on, so background stages only get timed
+        profile = self.profile if threading.current_thread() is threading.main_thread() else None
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if profile is not None:
+            profile.enable()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            if profile is not None:
+                profile.disable()
+            stage = self.get_stage(stage_name)
+            stage["seconds"] += seconds
+            stage["peak_memory"] = max(stage["peak_memory"], tracemalloc.get_traced_memory()[1] - start_memory)
+
+    def count(self, stage_name, counter, amount):
+        if self.enabled:
+            stage = self.get_stage(stage_name)
+            stage[counter] = stage.get(counter, 0) + amount
+
+    def cancel(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def finish(self):
+        global last_generation_report
+        if not self.enabled:
+            return None
+
+        report = {
+            "operator": self.name,
+            "total_seconds": time.perf_counter() - self.start_time,
+            "peak_memory": max([stage["peak_memory"] for stage in self.stages.values()], default=0),
+            "stages": self.stages,
+        }
+        self.cancel()
+
+        print("MIDI keyframes profile ({}): {:.1f} ms".format(self.name, report["total_seconds"] * 1000))
+        for stage_name, stage in self.stages.items():
+            print("  " + format_profile_stage(stage_name, stage))
+        if self.profile is not None:
+            stats_output = io.StringIO()
+            pstats.Stats(self.profile, stream=stats_output).sort_stats("cumulative").print_stats(20)
+            print(stats_output.getvalue())
+
+        if self.report_path != "":
+            report_path = handle_midi_file_path(self.report_path)
+            try:
+                with open(report_path, "w") as report_file:
+                    json.dump(report, report_file, indent=2)
+                if self.profile is not None:
+                    self.profile.dump_stats(report_path + ".prof")
+            except OSError as error:
+                print("Couldn't save profile report: {}".format(error))
+
+        last_generation_report = report
+        return report
+
+class KeyframeWriter:
+    """Collects keyframes per F-curve and writes each F-curve in one bulk operation"""
+    # Blender puts transform channels into this group when using `keyframe_insert()`
+    action_group = "Object Transforms"
+
+    def __init__(self, simplify_tolerance=None, frame_range=None) -> None:
+        # (object, data path, array index) -> { frame: (value, priority) }
+        self.channels = {}
+        # Only keys inside (first frame, last frame) get written, existing keys there are replaced
+        self.frame_range = frame_range
+        # Simplify each F-curve before writing it (None keeps every key)
+        self.simplify_tolerance = simplify_tolerance
+        self.removed_count = 0
+        self.written_count = 0
+        # object -> data paths of generated F-curves that get removed before writing (only inside the frame range if there's one)
+        self.cleared = {}
+        # action -> (data path, array index) of each F-curve written
+        self.generated_channels = {}
+        # Objects whose generated keys got cleared or written
+        self.written_objects = set()
 
-        last_keyframe = 0
-        last_note = None
+    @classmethod
+    def from_settings(cls, settings, frame_range=None):
+        return cls(settings.simplify_tolerance if settings.simplify_keyframes else None, frame_range)
+
+    def insert(self, obj, data_path, frame, values, priority=0):
+        # Later keys on the same frame replace earlier ones, same as `keyframe_insert()`.
+        # When simplifying, keys with a lower priority never replace higher ones (e.g. a release can't undo a press)
+        if self.frame_range is not None and not self.frame_range[0] <= frame <= self.frame_range[1]:
+            return
+        resolve_collisions = self.simplify_tolerance is not None
+        for index, value in enumerate(values):
+            channel = self.channels.setdefault((obj, data_path, index), {})
+            if resolve_collisions:
+                existing = channel.get(frame)
+                if existing is not None and existing[1] > priority:
+                    continue
+            channel[frame] = (value, priority)
+
+    def insert_curve(self, obj, data_path, index, keys):
+        # A whole channel at once, `keys` are (frame, value) pairs
+        channel = self.channels.setdefault((obj, data_path, index), {})
+        for frame, value in keys:
+            if self.frame_range is None or self.frame_range[0] <= frame <= self.frame_range[1]:
+                channel[frame] = (value, 0)
+
+    def clear(self, obj, data_paths):
+        self.cleared.setdefault(obj, set()).update(data_paths)
+
+    def clear_target(self, target):
+        # Keys we generated before get replaced instead of piling up (including other animation types)
+        for midi_note, obj in enumerate(target.note_objects):
+            if obj is not None and target.note_mask[midi_note]:
+                self.clear(obj, (target.note_data_paths[midi_note], *KeyAnimationTarget.data_paths.values()))
+
+    def get_fcurve(self, obj, data_path, index):
+        if obj.animation_data is None:
+            obj.animation_data_create()
+        action = obj.animation_data.action
+        if action is None:
+            action = bpy.data.actions.new(name="{}Action".format(obj.name))
+            obj.animation_data.action = action
+
+        fcurve = action.fcurves.find(data_path, index=index)
+        if fcurve is None:
+            fcurve = action.fcurves.new(data_path, index=index, action_group=self.action_group)
+        self.generated_channels.setdefault(action, set()).add((data_path, index))
+        return fcurve
+
+    def flush(self):
+        for progress in self.flush_steps():
+            pass
+
+    def flush_steps(self):
+        """Writes everything collected one object or F-curve per step, yielding how much is done (0 - 1)
+
+        Lets a modal operator spread the writes over several ticks. Objects that got deleted since the keys
+        were collected are skipped.
+        """
+        step_count = max(len(self.cleared) + len(self.channels), 1)
+        done_count = 0
+        cleared, self.cleared = self.cleared, {}
+        for obj, data_paths in cleared.items():
+            if id_exists(obj):
+                remove_generated_keyframes(obj, data_paths, self.frame_range)
+                self.written_objects.add(obj)
+            done_count += 1
+            yield done_count / step_count
+
+        channels, self.channels = self.channels, {}
+        for (obj, data_path, index), keys in channels.items():
+            if id_exists(obj):
+                self.write_channel(obj, data_path, index, keys)
+            done_count += 1
+            yield done_count / step_count
+
+        # Tag the F-curves we wrote, so they can be removed later without touching anything else
+        for action, action_channels in self.generated_channels.items():
+            set_generated_channels(action, get_generated_channels(action) | action_channels)
+        self.generated_channels = {}
+
+        # Stored fingerprints don't describe these keys anymore, a whole track generation saves its own afterwards
+        forget_generated_objects(self.written_objects)
+
+    def write_channel(self, obj, data_path, index, keys):
+        self.written_objects.add(obj)
+        if self.simplify_tolerance is not None:
+            simplified_keys = simplify_keyframes(keys, self.simplify_tolerance)
+            self.removed_count += len(keys) - len(simplified_keys)
+        else:
+            simplified_keys = [(frame, value) for frame, (value, priority) in keys.items()]
+        self.written_count += len(simplified_keys)
+
+        fcurve = self.get_fcurve(obj, data_path, index)
+        keyframe_points = fcurve.keyframe_points
+        if self.frame_range is not None:
+            remove_keyframes_in_range(fcurve, self.frame_range)
+        # Stored frames are single precision, so match them on a small threshold
+        pending = {round(frame, 2): (frame, value) for frame, value in simplified_keys}
+
+        # Overwrite existing keys on the same frame in place (keeps their handles and interpolation)
+        existing_count = len(keyframe_points)
+        coords = [0.0] * (existing_count * 2)
+        if existing_count > 0:
+            keyframe_points.foreach_get("co", coords)
+            for i in range(0, len(coords), 2):
+                match = pending.pop(round(coords[i], 2), None)
+                if match is not None:
+                    coords[i + 1] = match[1]
+
+        # Append the remaining keys in one go
+        for frame, value in pending.values():
+            coords.append(frame)
+            coords.append(value)
+        keyframe_points.add(len(pending))
+        keyframe_points.foreach_set("co", coords)
+
+        # Sorts keys and recalculates handles
+        fcurve.update()
+
+def forget_generated_objects(objects):
+    # Drops the objects from the fingerprint of every scene, so the next generation rebuilds their keys
+    id_keys = {get_fingerprint_key(obj) for obj in objects}
+    for scene in bpy.data.scenes:
+        midi_keyframe_props = scene.midi_keyframe_props
+        if midi_keyframe_props.generation_fingerprint == "":
+            continue
+        fingerprint = GenerationFingerprint(midi_keyframe_props.generation_fingerprint)
+        if id_keys.isdisjoint(fingerprint.objects):
+            continue
+        fingerprint.remove(id_keys)
+        midi_keyframe_props.generation_fingerprint = fingerprint.dumps()
+
+class KeyAnimationTarget:
+    """Snapshot of the key objects and animation settings used for one generation"""
+    data_paths = {"MOVE": "location", "SCALE": "scale", "ROTATE": "rotation_euler"}
+
+    def __init__(self, settings, note_objects) -> None:
+        self.animation_type = settings.animation_type
+        self.axis = int(settings.axis)
+        self.direction_factor = -1 if settings.direction == "down" else 1
+        self.travel_distance = settings.travel_distance
+        self.octave = int(settings.octave)
+        self.data_path = self.data_paths[self.animation_type]
+
+        # Dense lookup tables indexed by MIDI note, so each note event is just a few list lookups
+        self.note_objects = [None] * 128
+        self.note_data_paths = [self.data_path] * 128
+        self.initial_state = [0.0] * 128
+        self.rest_values = [None] * 128
+        self.pressed_values = [None] * 128
+        # Notes we animate at all (has a key object and is in the selected octave)
+        self.note_mask = bytearray(128)
+
+        for midi_note, move_obj in note_objects.items():
+            if move_obj is None or not 0 <= midi_note < 128:
+                continue
+            self.note_objects[midi_note] = move_obj
+            # 0 = All octaves
+            self.note_mask[midi_note] = self.octave == 0 or get_note_octave(midi_note) == self.octave
+
+            # Get initial position and the values for each state (from before our keys, not the current frame)
+            axis = self.axis
+            current_values = get_rest_values(move_obj, self.data_path)
+            match self.animation_type:
+                case "MOVE":
+                    initial_value = current_values[axis]
+                    # Position distance is negative for pressing (since we're in Z-axis going "down")
+                    # But it can be flipped by user preference
+                    rest_values = current_values
+                    pressed_values = list(rest_values)
+                    pressed_values[axis] = self.travel_distance * self.direction_factor + initial_value
+                case "SCALE":
+                    initial_value = current_values[0]
+                    # Scale "distance" is positive for pressing
+                    pressed_value = self.travel_distance + initial_value
+                    rest_values = (initial_value, initial_value, initial_value)
+                    pressed_values = (pressed_value, pressed_value, pressed_value)
+                case "ROTATE":
+                    initial_value = current_values[axis]
+                    # Rotation distance is positive for pressing
+                    rest_values = current_values
+                    pressed_values = list(rest_values)
+                    pressed_values[axis] = math.radians(self.travel_distance * self.direction_factor + initial_value)
 
+            self.initial_state[midi_note] = initial_value
+            self.rest_values[midi_note] = rest_values
+            self.pressed_values[midi_note] = pressed_values
 
-        # Loop over each MIDI track
-        for msg in self.midi.tracks[int(self.selected_track)]:
-            # mido returns "metadata" embedded alongside music
-            # we don't need so we filter out
-            # print(msg.type)
-            is_note = True if msg.type == "note_on" or msg.type == "note_off" else False
-            if not msg.is_meta and is_note:
-                pressed = True if msg.type == "note_on" else False
-                released = True if msg.type == "note_off" else False
+    @classmethod
+    def from_keys(cls, settings, keys):
+        # The key list starts at A0 (MIDI note 21)
+        return cls(settings, {index + 21: key.obj for index, key in enumerate(keys)})
 
-                # Figure out the actual note "letter" (e.g. C, C#, etc)
-                octave = get_note_octave(msg.note)
-                
-                # Increment time
-                time += msg.time
-                # Figure out what frame we're on
-                time_percent = time / self.total_time
-                current_frame = total_frames * time_percent
-                # print("time: {}, current frame: {}".format(time, current_frame))
-                real_time = tick2second(time, self.midi.ticks_per_beat, self.tempo) * speed
+    @classmethod
+    def from_keyboard(cls, settings, keys, node_tree):
+        # Each key is one value in the keyboard's node group (0 = rest, 1 = pressed), the node group moves the instance
+        target = cls(settings, {})
+        for index, key in enumerate(keys):
+            midi_note = index + 21
+            value_node = node_tree.nodes.get(get_keyboard_value_node_name(key.instance_index))
+            if key.instance_index < 0 or value_node is None:
+                continue
+            target.note_objects[midi_note] = node_tree
+            target.note_data_paths[midi_note] = 'nodes["{}"].outputs[0].default_value'.format(value_node.name)
+            target.note_mask[midi_note] = target.octave == 0 or get_note_octave(midi_note) == target.octave
+            target.rest_values[midi_note] = (0.0,)
+            target.pressed_values[midi_note] = (1.0,)
+        return target
 
-                # print("real time in seconds", real_time)
+    @classmethod
+    def from_settings(cls, settings):
+        # Key objects or the instanced keyboard, depending on the output
+        keyboard_obj = settings.keyboard_obj
+        if settings.output_target == "INSTANCES" and keyboard_obj is not None:
+            node_tree = get_keyboard_node_group(keyboard_obj)
+            if node_tree is not None:
+                update_keyboard_offsets(node_tree, settings)
+                return cls.from_keyboard(settings, settings.keys, node_tree)
+        return cls.from_keys(settings, settings.keys)
+
+def get_fingerprint_key(id_data):
+    # The type goes first, the instanced keyboard object and its node group share a name
+    return "{}:{}".format(id_data.id_type, id_data.name)
+
+def find_fingerprint_id(id_key):
+    id_type, _, name = id_key.partition(":")
+    collection_name = ID_COLLECTIONS.get(id_type)
+    return getattr(bpy.data, collection_name).get(name) if collection_name is not None else None
+
+def id_exists(id_data):
+    # Deleted IDs raise on access, and a new ID with the same name isn't the one we collected keys for
+    try:
+        if id_data.id_type not in ID_COLLECTIONS:
+            return id_data.name is not None
+        return find_fingerprint_id(get_fingerprint_key(id_data)) == id_data
+    except ReferenceError:
+        return False
+
+class GenerationFingerprint:
+    """What went into the last generation of each key object, so regenerating only rebuilds what changed"""
+
+    def __init__(self, stored) -> None:
+        # ID key (see `get_fingerprint_key()`) -> { "hash": inputs hash, "data_paths": animated properties }.
+        # Older fingerprints stored plain object names under "objects", those just start over
+        self.objects = json.loads(stored).get("ids", {}) if stored != "" else {}
+
+    def get_object_inputs(self, target, inputs):
+        # Hash of everything that affects an object's F-curves: shared inputs plus the notes it plays
+        object_notes = {}
+        for midi_note, move_obj in enumerate(target.note_objects):
+            if move_obj is not None and target.note_mask[midi_note]:
+                object_notes.setdefault(get_fingerprint_key(move_obj), []).append(midi_note)
+
+        object_inputs = {}
+        for object_name, notes in object_notes.items():
+            # Moving the object moves its rest pose, that changes every key too
+            rest_values = [list(target.rest_values[midi_note]) for midi_note in notes]
+            inputs_json = json.dumps([inputs, object_name, notes, rest_values], sort_keys=True)
+            object_inputs[object_name] = {
+                "hash": hashlib.blake2b(inputs_json.encode(), digest_size=16).hexdigest(),
+                "data_paths": sorted({target.note_data_paths[midi_note] for midi_note in notes}),
+            }
+        return object_inputs
+
+    def get_changed_objects(self, object_inputs):
+        return {object_name for object_name, entry in object_inputs.items() if self.objects.get(object_name) != entry}
+
+    def get_dropped_objects(self, target):
+        # Objects we generated keys for before that no key uses anymore (e.g. the key got another object)
+        assigned_names = {get_fingerprint_key(move_obj) for move_obj in target.note_objects if move_obj is not None}
+        return [object_name for object_name in self.objects if object_name not in assigned_names]
+
+    def remove(self, object_names):
+        for object_name in object_names:
+            self.objects.pop(object_name, None)
+
+    def update(self, object_inputs):
+        self.objects.update(object_inputs)
+
+    def dumps(self):
+        return json.dumps({"ids": self.objects}, sort_keys=True)
+
+class JumpPath:
+    """Landing and apex keys of the jumping object for a whole track, solved in one go"""
+
+    def __init__(self, midi_file, key_positions, fps, speed, base_location, chord_target="CENTER",
+                 travel_distance=1.0, height_mode="FIXED", height_scale=0.0) -> None:
+        # `key_positions` is the world X position per MIDI note (None when the note has no key)
+        spans = midi_file.note_spans
+        start_frames, end_frames = spans.get_frames(fps, speed)
+        notes = spans.notes
+        note_mask = bytearray(position is not None for position in key_positions)
+
+        # One landing per chord: notes that start (almost) together
+        self.landing_frames = array("d")
+        self.landing_x = array("d")
+        chord_notes = []
+        for index in spans.get_span_indices(note_mask):
+            frame = start_frames[index]
+            if chord_notes and frame - self.landing_frames[-1] < CHORD_FRAME_DISTANCE:
+                chord_notes.append(notes[index])
+                continue
+            if chord_notes:
+                self.landing_x.append(self.get_chord_x(chord_notes, key_positions, chord_target))
+            self.landing_frames.append(frame)
+            chord_notes = [notes[index]]
+        if chord_notes:
+            self.landing_x.append(self.get_chord_x(chord_notes, key_positions, chord_target))
+
+        # Apex halfway between each landing and the one before, jumps need at least a frame in between
+        self.apex_frames = array("d")
+        self.apex_x = array("d")
+        self.apex_heights = array("d")
+        landing_frames = self.landing_frames
+        landing_x = self.landing_x
+        for i in range(1, len(landing_frames)):
+            gap = landing_frames[i] - landing_frames[i - 1]
+            if gap < 2:
+                continue
+            distance = abs(landing_x[i] - landing_x[i - 1])
+            height = travel_distance
+            if height_mode == "DISTANCE":
+                height += height_scale * distance
+            elif height_mode == "TIME":
+                height += height_scale * gap / fps
+            self.apex_frames.append(landing_frames[i - 1] + gap / 2)
+            self.apex_x.append((landing_x[i] + landing_x[i - 1]) / 2)
+            self.apex_heights.append(height)
+
+        self.base_location = tuple(base_location)
+
+    @staticmethod
+    def get_chord_x(chord_notes, key_positions, chord_target):
+        if chord_target == "LOWEST":
+            return key_positions[min(chord_notes)]
+        if chord_target == "HIGHEST":
+            return key_positions[max(chord_notes)]
+        return sum(key_positions[note] for note in chord_notes) / len(chord_notes)
+
+    @classmethod
+    def from_settings(cls, midi_file, settings, fps):
+        # World positions only get read once per key, not on every note
+        key_positions = [None] * 128
+        for index, key in enumerate(settings.keys):
+            # The key list starts at A0 (MIDI note 21)
+            if key.obj is not None and index + 21 < 128:
+                key_positions[index + 21] = key.obj.matrix_world.to_translation().x
+        return cls(midi_file, key_positions, fps, settings.speed, get_rest_values(settings.obj_jump, "location"),
+                   settings.jump_chord_target, settings.travel_distance, settings.jump_height_mode, settings.jump_height_scale)
+
+    def __len__(self):
+        return len(self.landing_frames)
+
+    def write(self, obj, keyframe_writer):
+        base_x, base_y, base_z = self.base_location
+        keyframe_writer.clear(obj, ("location",))
+        # Starting position
+        keyframe_writer.insert(obj, "location", 0, (base_x, base_y, base_z))
+        for frame, x in zip(self.landing_frames, self.landing_x):
+            keyframe_writer.insert(obj, "location", frame, (x, base_y, base_z))
+        for frame, x, height in zip(self.apex_frames, self.apex_x, self.apex_heights):
+            keyframe_writer.insert(obj, "location", frame, (x, base_y, base_z + height))
+
+class LivePlayback:
+    """Poses key objects for the current frame straight from the key presses, without keyframes"""
+
+    def __init__(self, midi_file, target, fps, speed) -> None:
+        self.target = target
+        # Press start/end frames and velocities per note, sorted by start so a frame's press can be bisected
+        self.press_starts = [array("d") for midi_note in range(128)]
+        self.press_ends = [array("d") for midi_note in range(128)]
+        self.press_velocities = [array("B") for midi_note in range(128)]
+        # Frames where a key starts or stops moving, sorted, and the note for each
+        change_points = []
+        for midi_note, start_frame, end_frame, velocity in midi_file.get_key_presses(fps, speed, target.note_mask):
+            self.press_starts[midi_note].append(start_frame)
+            self.press_ends[midi_note].append(end_frame)
+            self.press_velocities[midi_note].append(velocity)
+            change_points.append((start_frame - 1, midi_note))
+            change_points.append((end_frame + 1, midi_note))
+        change_points.sort()
+        self.change_frames = array("d", [frame for frame, midi_note in change_points])
+        self.change_notes = array("B", [midi_note for frame, midi_note in change_points])
+
+        self.animated_notes = [midi_note for midi_note in range(128) if target.note_mask[midi_note] and target.note_objects[midi_note] is not None]
+        # Notes that weren't at rest on the last frame we posed
+        self.active_notes = set()
+        self.last_frame = None
+
+    def get_press_amount(self, midi_note, frame):
+        # How far the key is pressed (0 - 1), same timing as `animate_keys()`:
+        # rest a frame before the press starts, pressed until it ends, rest a frame later
+        starts = self.press_starts[midi_note]
+        index = bisect.bisect_right(starts, frame + 1) - 1
+        if index < 0:
+            return 0.0
+        start_frame = starts[index]
+        end_frame = self.press_ends[midi_note][index]
+        if frame < start_frame:
+            return frame - (start_frame - 1)
+        if frame <= end_frame:
+            return 1.0
+        return max(0.0, end_frame + 1 - frame)
+
+    def pose_key(self, midi_note, amount):
+        target = self.target
+        values = [rest_value + (pressed_value - rest_value) * amount for rest_value, pressed_value in zip(target.rest_values[midi_note], target.pressed_values[midi_note])]
+        set_property_values(target.note_objects[midi_note], target.note_data_paths[midi_note], values)
+
+    def update(self, frame):
+        # Playing forward only touches keys that were moving or start/stop moving since the last frame
+        notes = self.animated_notes
+        if self.last_frame is not None:
+            first_frame, last_frame = sorted((self.last_frame, frame))
+            first_index = bisect.bisect_left(self.change_frames, first_frame)
+            last_index = bisect.bisect_right(self.change_frames, last_frame)
+            if last_index - first_index < len(notes):
+                notes = self.active_notes.union(self.change_notes[first_index:last_index])
+        self.last_frame = frame
+
+        for midi_note in notes:
+            amount = self.get_press_amount(midi_note, frame)
+            self.pose_key(midi_note, amount)
+            if amount > 0:
+                self.active_notes.add(midi_note)
+            else:
+                self.active_notes.discard(midi_note)
+
+    def restore(self):
+        for midi_note in self.animated_notes:
+            self.pose_key(midi_note, 0.0)
+        self.active_notes.clear()
+        self.last_frame = None
+
+    def bake(self, keyframe_writer):
+        for midi_note in self.animated_notes:
+            for start_frame, end_frame, velocity in zip(self.press_starts[midi_note], self.press_ends[midi_note], self.press_velocities[midi_note]):
+                animate_keys(None, midi_note, start_frame, end_frame, velocity, target=self.target, keyframe_writer=keyframe_writer)
+
+class MidiFileCache:
+    """Parsed MIDI files shared across operators and the UI, least recently used are evicted first"""
+
+    def __init__(self, max_files=MIDI_CACHE_MAX_FILES, max_bytes=MIDI_CACHE_MAX_BYTES) -> None:
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        # (path, mtime, size) -> CachedMidiFile, oldest first
+        self.entries = OrderedDict()
+        # Files get loaded from background threads too, parsing itself happens outside the lock
+        self.lock = threading.RLock()
+
+    def get_key(self, midi_file_path):
+        fixed_midi_file_path = os.path.abspath(handle_midi_file_path(midi_file_path))
+        try:
+            stat = os.stat(fixed_midi_file_path)
+        except OSError:
+            return None
+        return (fixed_midi_file_path, stat.st_mtime_ns, stat.st_size)
+
+    def get(self, midi_file_path):
+        key = self.get_key(midi_file_path)
+        if key is None:
+            return None
+
+        with self.lock:
+            cached_file = self.entries.get(key)
+            if cached_file is not None:
+                self.entries.move_to_end(key)
+                return cached_file
+
+            # Drop outdated versions of the same file
+            for old_key in [old_key for old_key in self.entries if old_key[0] == key[0]]:
+                del self.entries[old_key]
+
+            cached_file = CachedMidiFile(key)
+            self.entries[key] = cached_file
+            self.evict()
+            return cached_file
+
+    def get_content_hash(self, midi_file_path):
+        cached_file = self.get(midi_file_path)
+        if cached_file is None:
+            return None
+        return cached_file.get_content_hash()
+
+    def get_parsed_track(self, midi_file_path, selected_track, timeline_cache_dir=None):
+        cached_file = self.get(midi_file_path)
+        if cached_file is None:
+            return None
+        parsed = cached_file.get_parsed_track(selected_track, timeline_cache_dir)
+        self.evict()
+        return parsed
+
+    def evict(self):
+        # Always keep the most recently used file, even if it's over budget by itself
+        with self.lock:
+            while len(self.entries) > 1 and (len(self.entries) > self.max_files or sum(cached_file.size for cached_file in self.entries.values()) > self.max_bytes):
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+midi_file_cache = MidiFileCache()
+
+def get_live_playback(scene):
+    midi_keyframe_props = scene.midi_keyframe_props
+    # Anything that changes the poses rebuilds the playback
+    settings = (
+        midi_keyframe_props.midi_file,
+        midi_keyframe_props.selected_track,
+        scene.render.fps,
+        midi_keyframe_props.speed,
+        midi_keyframe_props.animation_type,
+        midi_keyframe_props.axis,
+        midi_keyframe_props.direction,
+        midi_keyframe_props.travel_distance,
+        midi_keyframe_props.octave,
+        midi_keyframe_props.output_target,
+        midi_keyframe_props.keyboard_obj,
+        tuple((key.obj, key.instance_index) for key in midi_keyframe_props.keys),
+    )
+    cached_settings, live_playback = live_playbacks.get(scene.name, (None, None))
+    if cached_settings == settings:
+        return live_playback
+
+    # Rest poses are read from the keys, so they have to be at rest again first.
+    # Dropped before restoring, a key that got deleted in the meantime can't keep the old playback around
+    live_playbacks.pop(scene.name, None)
+    if live_playback is not None:
+        live_playback.restore()
+    if ".mid" not in midi_keyframe_props.midi_file:
+        return None
+    midi_file = midi_file_cache.get_parsed_track(midi_keyframe_props.midi_file, midi_keyframe_props.selected_track, get_timeline_cache_dir(midi_keyframe_props))
+    if midi_file is None:
+        return None
+
+    target = KeyAnimationTarget.from_settings(midi_keyframe_props)
+    live_playback = LivePlayback(midi_file, target, scene.render.fps, midi_keyframe_props.speed)
+    live_playbacks[scene.name] = (settings, live_playback)
+    return live_playback
+
+def stop_live_playback(scene):
+    cached_settings, live_playback = live_playbacks.pop(scene.name, (None, None))
+    if live_playback is not None:
+        live_playback.restore()
+
+@persistent
+def live_playback_handler(scene, depsgraph=None):
+    if not scene.midi_keyframe_props.live_playback:
+        return
+    live_playback = get_live_playback(scene)
+    if live_playback is not None:
+        live_playback.update(scene.frame_current)
+
+@persistent
+def drop_live_playbacks(*args):
+    # Loading a file or undoing frees the key objects, so there's nothing left to restore.
+    # The next frame change builds the playback again
+    live_playbacks.clear()
+
+@persistent
+def rest_live_playbacks(*args):
+    # Files get saved with the keys at rest, otherwise their pressed poses would be read as rest poses after loading
+    for cached_settings, live_playback in live_playbacks.values():
+        live_playback.restore()
+
+@persistent
+def pose_live_playbacks(*args):
+    for scene_name, (cached_settings, live_playback) in live_playbacks.items():
+        scene = bpy.data.scenes.get(scene_name)
+        if scene is not None:
+            live_playback.update(scene.frame_current)
+
+# Handler list name -> function, for keeping live playback in sync with the file
+live_playback_handlers = (
+    ("frame_change_post", live_playback_handler),
+    ("load_pre", drop_live_playbacks),
+    ("undo_post", drop_live_playbacks),
+    ("redo_post", drop_live_playbacks),
+    ("save_pre", rest_live_playbacks),
+    ("save_post", pose_live_playbacks),
+)
+
+class GI_bake_live_playback(bpy.types.Operator):
+    """Bake live playback"""
+    bl_idname = "wm.bake_live_playback"
+    bl_label = "Bake Live Playback"
+    bl_description = "Turns live playback into keyframes on the piano keys"
+    bl_options = {'REGISTER', 'UNDO'}
 
-                real_keyframe = (real_time * fps) + 1
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        live_playback = get_live_playback(context.scene)
+        if live_playback is None:
+            return {"CANCELLED"}
 
-                key_callback(context, msg.note, octave, real_keyframe, pressed, self.has_release, last_keyframe, last_note)
+        # Keyframes start from the rest pose, same as regular generation
+        live_playback.restore()
+        keyframe_writer = KeyframeWriter.from_settings(midi_keyframe_props)
+        keyframe_writer.clear_target(live_playback.target)
+        live_playback.bake(keyframe_writer)
+        keyframe_writer.flush()
+        report_removed_keyframes(self, keyframe_writer)
 
-                last_keyframe = real_keyframe
-                last_note = msg.note
+        midi_keyframe_props.live_playback = False
+        return {"FINISHED"}
 
 class GI_generate_piano_animation(bpy.types.Operator):
     """Generate animation"""
     bl_idname = "wm.generate_piano_animation"
     bl_label = "Piano Key Animation"
     bl_description = "Creates keyframes on piano key objects to simulate playback"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        # Only one background generation at a time
+        return generation_progress is None
+
+    def skip_unchanged_keys(self, context, content_hash):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        target = self.target
+
+        # Fingerprints describe whole tracks, frame ranges rebuild every key inside the range instead
+        if self.frame_range is not None:
+            self.fingerprint = None
+            self.keyframe_writer.clear_target(target)
+            animate_frame_range_boundaries(self.frame_range, target, self.keyframe_writer)
+            return
+
+        # Everything that's shared by all keys
+        inputs = {
+            "midi": content_hash.hex(),
+            "track": midi_keyframe_props.selected_track,
+            "fps": context.scene.render.fps,
+            "speed": midi_keyframe_props.speed,
+            "animation_type": target.animation_type,
+            "axis": target.axis,
+            "direction": target.direction_factor,
+            "travel_distance": target.travel_distance,
+            "simplify_tolerance": self.keyframe_writer.simplify_tolerance,
+        }
+        self.fingerprint = GenerationFingerprint(midi_keyframe_props.generation_fingerprint)
+        self.object_inputs = self.fingerprint.get_object_inputs(target, inputs)
+        if midi_keyframe_props.incremental_generation:
+            rebuilt_objects = self.fingerprint.get_changed_objects(self.object_inputs)
+        else:
+            rebuilt_objects = set(self.object_inputs)
+
+        # Leave keys that didn't change alone
+        for midi_note, move_obj in enumerate(target.note_objects):
+            if move_obj is not None and get_fingerprint_key(move_obj) not in rebuilt_objects:
+                target.note_mask[midi_note] = False
+        self.keyframe_writer.clear_target(target)
+
+        # Objects that aren't keys anymore lose what we generated for them
+        dropped_objects = self.fingerprint.get_dropped_objects(target)
+        for object_name in dropped_objects:
+            dropped_obj = find_fingerprint_id(object_name)
+            if dropped_obj is not None:
+                data_paths = self.fingerprint.objects[object_name].get("data_paths", [])
+                self.keyframe_writer.clear(dropped_obj, (*data_paths, *KeyAnimationTarget.data_paths.values()))
+        self.fingerprint.remove(dropped_objects)
+
+    def save_fingerprint(self, context):
+        if self.fingerprint is None:
+            return
+        self.fingerprint.update(self.object_inputs)
+        context.scene.midi_keyframe_props.generation_fingerprint = self.fingerprint.dumps()
+
+    def get_key_presses(self, context, midi_file):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        profiler = self.profiler
+        if profiler.enabled:
+            profiler.count("load_midi", "notes", len(midi_file.note_spans))
+            profiler.count("key_presses", "skipped_by_octave", get_octave_skipped_count(midi_file, self.target))
+
+        # Notes without a key or outside of the selected octave are skipped up front
+        with profiler.stage("key_presses"):
+            key_presses = midi_file.get_key_presses(context.scene.render.fps, midi_keyframe_props.speed, self.target.note_mask, frame_range=self.frame_range)
+        self.event_count = len(key_presses)
+        profiler.count("key_presses", "presses", self.event_count)
+        return iter(key_presses)
+
+    def write_keyframes(self, context):
+        # Write all collected keyframes to the F-curves in one go
+        with self.profiler.stage("write_keyframes"):
+            self.keyframe_writer.flush()
+        self.finish_writing(context)
+
+    def finish_writing(self, context):
+        self.profiler.count("write_keyframes", "keys_written", self.keyframe_writer.written_count)
+        self.profiler.count("write_keyframes", "keys_simplified", self.keyframe_writer.removed_count)
+        self.save_fingerprint(context)
+        report_removed_keyframes(self, self.keyframe_writer)
+        self.profiler.finish()
 
     def execute(self, context: bpy.types.Context):
         midi_keyframe_props = context.scene.midi_keyframe_props
         midi_file_path = midi_keyframe_props.midi_file
         selected_track = midi_keyframe_props.selected_track
-        animation_type = midi_keyframe_props.animation_type
-        axis = int(midi_keyframe_props.axis)
 
         # Is it a MIDI file? If not, bail early
         if not has_valid_midi_file(context):
             return {"FINISHED"}
 
+        # Import the MIDI file (or reuse it if we parsed it before)
+        self.profiler = GenerationProfiler.from_settings(self.bl_idname, midi_keyframe_props)
+        with self.profiler.stage("load_midi"):
+            midi_file = midi_file_cache.get_parsed_track(midi_file_path, selected_track, get_timeline_cache_dir(midi_keyframe_props))
+        if midi_file is None:
+            self.profiler.cancel()
+            return {"CANCELLED"}
 
-        # Import the MIDI file
-        print("Parsing MIDI file...") 
-        midi_file = ParsedMidiFile(midi_file_path, selected_track)
+        self.target = KeyAnimationTarget.from_settings(midi_keyframe_props)
+        self.frame_range = get_frame_range(context)
+        self.keyframe_writer = KeyframeWriter.from_settings(midi_keyframe_props, self.frame_range)
+        self.skip_unchanged_keys(context, midi_file_cache.get_content_hash(midi_file_path))
 
-        # Debug - check for meta messages    
-        # for msg in mid.tracks[int(selected_track)]:
-        #     is_note = True if msg.type == "note_on" or msg.type == "note_off" else False
-        #     if not is_note:
-        #         print(msg)
+        # Loop over each music note and collect keyframes for corresponding keys
+        key_presses = self.get_key_presses(context, midi_file)
+        with self.profiler.stage("animate_keys"):
+            for key_press in key_presses:
+                animate_keys(context, *key_press, target=self.target, keyframe_writer=self.keyframe_writer)
+        self.profiler.count("animate_keys", "calls", self.event_count)
 
-        # Get initial positions for each key
-        for key in context.scene.midi_keyframe_props.keys:
-            # Get the right object corresponding to the note
-            key_name = key.name
-            move_obj = key.obj
-            if move_obj == None:
-                continue
-            
-            match animation_type:
-                case "MOVE":
-                    midi_keyframe_props.initial_state[key_name] = move_obj.location[axis]
+        self.write_keyframes(context)
+        return {"FINISHED"}
 
-                case "SCALE":
-                    midi_keyframe_props.initial_state[key_name] = move_obj.scale.x
-                    
-                case "ROTATE":
-                    midi_keyframe_props.initial_state[key_name] = move_obj.rotation_euler[axis]
+    def invoke(self, context, event):
+        global generation_progress
+        midi_keyframe_props = context.scene.midi_keyframe_props
+
+        # Is it a MIDI file? If not, bail early
+        if not has_valid_midi_file(context):
+            return {"FINISHED"}
+
+        # Parse the file in the background, it doesn't need anything from Blender
+        self.profiler = GenerationProfiler.from_settings(self.bl_idname, midi_keyframe_props)
+        self.worker_result = {}
+        self.worker = threading.Thread(
+            target=self.load_midi_file,
+            args=(handle_midi_file_path(midi_keyframe_props.midi_file), midi_keyframe_props.selected_track, get_timeline_cache_dir(midi_keyframe_props)),
+            daemon=True)
+        self.worker.start()
+
+        self.target = KeyAnimationTarget.from_settings(midi_keyframe_props)
+        self.frame_range = get_frame_range(context)
+        self.keyframe_writer = KeyframeWriter.from_settings(midi_keyframe_props, self.frame_range)
+        self.key_presses = None
+        self.event_count = 0
+        self.processed_count = 0
+        # Steps of writing the keyframes, once they're all collected
+        self.write_steps = None
+
+        generation_progress = 0.0
+        self.timer = context.window_manager.event_timer_add(0.01, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def load_midi_file(self, midi_file_path, selected_track, timeline_cache_dir):
+        try:
+            with self.profiler.stage("load_midi"):
+                self.worker_result["midi_file"] = midi_file_cache.get_parsed_track(midi_file_path, selected_track, timeline_cache_dir)
+            self.worker_result["content_hash"] = midi_file_cache.get_content_hash(midi_file_path)
+        except Exception as error:
+            self.worker_result["error"] = error
+
+    def modal(self, context, event):
+        try:
+            return self.modal_step(context, event)
+        except Exception:
+            # Don't leave the timer running and the panel stuck on the progress bar
+            self.finish(context)
+            raise
+
+    def modal_step(self, context, event):
+        global generation_progress
+
+        # Nothing gets written until all keys are collected, so cancelling before that leaves the scene untouched.
+        # Once writing started it has to finish, half written keys would be worse than either
+        if event.type == 'ESC' and self.write_steps is None:
+            self.finish(context)
+            self.report({"WARNING"}, "Cancelled generating keyframes")
+            return {"CANCELLED"}
+
+        if event.type != 'TIMER':
+            return {"PASS_THROUGH"}
+
+        # Wait for the MIDI file
+        if self.key_presses is None:
+            if self.worker.is_alive():
+                return {"PASS_THROUGH"}
+            midi_file = self.worker_result.get("midi_file")
+            if midi_file is None:
+                self.finish(context)
+                self.report({"ERROR"}, "Couldn't load MIDI file: {}".format(self.worker_result.get("error", "file not found")))
+                return {"CANCELLED"}
+            self.skip_unchanged_keys(context, self.worker_result["content_hash"])
+            self.key_presses = self.get_key_presses(context, midi_file)
+
+        # Collect keyframes until we run out of time for this tick
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        deadline = time.perf_counter() + midi_keyframe_props.time_budget / 1000
+        if self.write_steps is None:
+            with self.profiler.stage("animate_keys"):
+                for key_press in self.key_presses:
+                    animate_keys(context, *key_press, target=self.target, keyframe_writer=self.keyframe_writer)
+                    self.processed_count += 1
+                    if time.perf_counter() > deadline:
+                        break
+                else:
+                    self.profiler.count("animate_keys", "calls", self.processed_count)
+                    self.write_steps = self.keyframe_writer.flush_steps()
+            # Collecting is the first half of the progress bar
+            generation_progress = self.processed_count / max(self.event_count, 1) / 2
+
+        # Then write them an F-curve at a time, within the same time budget
+        if self.write_steps is not None:
+            with self.profiler.stage("write_keyframes"):
+                for write_progress in self.write_steps:
+                    generation_progress = 0.5 + write_progress / 2
+                    if time.perf_counter() > deadline:
+                        break
+                else:
+                    self.finish_writing(context)
+                    self.finish(context)
+                    return {"FINISHED"}
+
+        tag_redraw_panels(context)
+        return {"PASS_THROUGH"}
+
+    def finish(self, context):
+        global generation_progress
+        if self.timer is None:
+            return
+        context.window_manager.event_timer_remove(self.timer)
+        self.timer = None
+        generation_progress = None
+        # Stops memory tracing when cancelled before the profile got finished
+        self.profiler.cancel()
+        tag_redraw_panels(context)
+
+class GI_generate_batch_animation(bpy.types.Operator):
+    """Generate animation for several tracks at once"""
+    bl_idname = "wm.generate_batch_animation"
+    bl_label = "All Track Targets"
+    bl_description = "Creates keyframes for every track target (in any scene) using one pass over the MIDI file"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        midi_file_path = midi_keyframe_props.midi_file
+
+        # Is it a MIDI file? If not, bail early
+        if not has_valid_midi_file(context):
+            return {"FINISHED"}
+
+        # Every track comes from the same cached file, so it only gets read once
+        cached_file = midi_file_cache.get(midi_file_path)
+        if cached_file is None:
+            return {"CANCELLED"}
+        timeline_cache_dir = get_timeline_cache_dir(midi_keyframe_props)
+        profiler = GenerationProfiler.from_settings(self.bl_idname, midi_keyframe_props)
+
+        try:
+            name_pattern = re.compile(midi_keyframe_props.key_name_pattern)
+        except re.error as error:
+            self.report({"ERROR"}, "Invalid key name pattern: {}".format(error))
+            return {"CANCELLED"}
+
+        # Targets in other scenes use that scene's frame rate, speed and frame range.
+        # Targets with the same frame rate and speed go one after another, so the frames
+        # of each track get computed once per pair instead of once per target
+        scene_targets = []
+        for track_target in midi_keyframe_props.track_targets:
+            scene = track_target.scene if track_target.scene is not None else context.scene
+            scene_targets.append((scene.render.fps, scene.midi_keyframe_props.speed, scene, track_target))
+        scene_targets.sort(key=lambda scene_target: scene_target[:2])
+
+        # One writer per frame range, since the range decides which keys get replaced
+        keyframe_writers = {}
+        timelines = set()
+        key_press_streams = []
+        for fps, speed, scene, track_target in scene_targets:
+            scene_props = scene.midi_keyframe_props
+            if track_target.collection is not None:
+                key_objects = find_key_objects(track_target.collection, scene_props.keys, name_pattern, midi_keyframe_props.key_search_children)
+                target = KeyAnimationTarget(track_target, {index + 21: obj for index, obj in key_objects.items()})
+            else:
+                target = KeyAnimationTarget.from_keys(track_target, scene_props.keys)
+
+            frame_range = get_scene_frame_range(scene)
+            keyframe_writer = keyframe_writers.get(frame_range)
+            if keyframe_writer is None:
+                keyframe_writer = KeyframeWriter.from_settings(midi_keyframe_props, frame_range)
+                keyframe_writers[frame_range] = keyframe_writer
+            keyframe_writer.clear_target(target)
+            if frame_range is not None:
+                animate_frame_range_boundaries(frame_range, target, keyframe_writer)
+
+            with profiler.stage("load_midi"):
+                midi_file = cached_file.get_parsed_track(track_target.track, timeline_cache_dir)
+            with profiler.stage("key_presses"):
+                key_presses = midi_file.get_key_presses(fps, speed, target.note_mask, frame_range=frame_range)
+            timelines.add((track_target.track, fps, speed))
+            if profiler.enabled:
+                profiler.count("load_midi", "notes", len(midi_file.note_spans))
+                profiler.count("key_presses", "skipped_by_octave", get_octave_skipped_count(midi_file, target))
+                profiler.count("key_presses", "presses", len(key_presses))
+            key_press_streams.append(self.get_target_stream(target, keyframe_writer, key_presses))
+        midi_file_cache.evict()
+        profiler.count("key_presses", "timelines", len(timelines))
+        profiler.count("key_presses", "targets", len(scene_targets))
+
+        # Walk all tracks in time order and group the keyframes per object before writing them
+        with profiler.stage("animate_keys"):
+            for target, keyframe_writer, key_press in heapq.merge(*key_press_streams, key=lambda target_press: target_press[2][1]):
+                animate_keys(context, *key_press, target=target, keyframe_writer=keyframe_writer)
+        with profiler.stage("write_keyframes"):
+            for keyframe_writer in keyframe_writers.values():
+                keyframe_writer.flush()
+                profiler.count("write_keyframes", "keys_written", keyframe_writer.written_count)
+                profiler.count("write_keyframes", "keys_simplified", keyframe_writer.removed_count)
+                report_removed_keyframes(self, keyframe_writer)
+        profiler.finish()
+
+        return {"FINISHED"}
+
+    def get_target_stream(self, target, keyframe_writer, key_presses):
+        for key_press in key_presses:
+            yield target, keyframe_writer, key_press
+
+class GI_add_track_target(bpy.types.Operator):
+    """Add track target"""
+    bl_idname = "wm.add_track_target"
+    bl_label = "Add Track Target"
+    bl_description = "Adds a track to animate in batch mode"
+
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        midi_keyframe_props.track_targets.add()
+        midi_keyframe_props.selected_track_target = len(midi_keyframe_props.track_targets) - 1
+        return {"FINISHED"}
+
+class GI_remove_track_target(bpy.types.Operator):
+    """Remove track target"""
+    bl_idname = "wm.remove_track_target"
+    bl_label = "Remove Track Target"
+    bl_description = "Removes the selected track target"
 
-        # Loop over each music note and animate corresponding keys
-        midi_file.for_each_key(context, animate_keys)
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        index = midi_keyframe_props.selected_track_target
+        if 0 <= index < len(midi_keyframe_props.track_targets):
+            midi_keyframe_props.track_targets.remove(index)
+            midi_keyframe_props.selected_track_target = max(index - 1, 0)
+        return {"FINISHED"}
+
+class GI_add_controller_target(bpy.types.Operator):
+    """Add controller target"""
+    bl_idname = "wm.add_controller_target"
+    bl_label = "Add Controller Target"
+    bl_description = "Adds a controller to bake into an object property"
+
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        midi_keyframe_props.controller_targets.add()
+        midi_keyframe_props.selected_controller_target = len(midi_keyframe_props.controller_targets) - 1
+        return {"FINISHED"}
 
+class GI_remove_controller_target(bpy.types.Operator):
+    """Remove controller target"""
+    bl_idname = "wm.remove_controller_target"
+    bl_label = "Remove Controller Target"
+    bl_description = "Removes the selected controller target"
+
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        index = midi_keyframe_props.selected_controller_target
+        if 0 <= index < len(midi_keyframe_props.controller_targets):
+            midi_keyframe_props.controller_targets.remove(index)
+            midi_keyframe_props.selected_controller_target = max(index - 1, 0)
+        return {"FINISHED"}
+
+class GI_generate_controller_animation(bpy.types.Operator):
+    """Generate controller animation"""
+    bl_idname = "wm.generate_controller_animation"
+    bl_label = "Controller Animation"
+    bl_description = "Bakes control changes and pitch bend of the selected track into keyframes on the controller targets"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        midi_file_path = midi_keyframe_props.midi_file
+
+        # Is it a MIDI file? If not, bail early
+        if not has_valid_midi_file(context):
+            return {"FINISHED"}
+
+        cached_file = midi_file_cache.get(midi_file_path)
+        if cached_file is None:
+            return {"CANCELLED"}
+        timeline_cache_dir = get_timeline_cache_dir(midi_keyframe_props)
+        fps = context.scene.render.fps
+        frame_range = get_frame_range(context)
+        # Curves get decimated here, the writer's simplify is made for key presses
+        keyframe_writer = KeyframeWriter(None, frame_range)
+        profiler = GenerationProfiler.from_settings(self.bl_idname, midi_keyframe_props)
+
+        for controller_target in midi_keyframe_props.controller_targets:
+            obj = controller_target.obj
+            if obj is None:
+                continue
+            try:
+                obj.path_resolve(controller_target.data_path)
+            except ValueError:
+                self.report({"WARNING"}, "{} has no property '{}'".format(obj.name, controller_target.data_path))
+                continue
+
+            match controller_target.controller:
+                case "PITCH_BEND":
+                    controller = PITCH_BEND_CONTROLLER
+                case "CUSTOM":
+                    controller = controller_target.cc_number
+                case _:
+                    controller = int(controller_target.controller)
+            channel = controller_target.channel - 1 if controller_target.channel > 0 else None
+
+            with profiler.stage("load_controller"):
+                curve = cached_file.get_controller_curve(midi_keyframe_props.selected_track, controller, channel, timeline_cache_dir)
+            profiler.count("load_controller", "events", len(curve))
+            if len(curve) == 0:
+                continue
+
+            # One value per frame, mapped to the property's range, then only the keys that shape the curve
+            with profiler.stage("decimate"):
+                first_frame, values = curve.resample(fps, midi_keyframe_props.speed)
+                min_value = controller_target.min_value
+                value_range = controller_target.max_value - min_value
+                values = [min_value + value * value_range for value in values]
+                keys = decimate_keyframes(first_frame, values, midi_keyframe_props.controller_tolerance)
+            profiler.count("decimate", "frames", len(values))
+            profiler.count("decimate", "keys", len(keys))
+
+            # Replace what we baked into this channel before
+            remove_generated_keyframes(obj, (controller_target.data_path,), frame_range, controller_target.array_index)
+            keyframe_writer.insert_curve(obj, controller_target.data_path, controller_target.array_index, keys)
+        midi_file_cache.evict()
+
+        with profiler.stage("write_keyframes"):
+            keyframe_writer.flush()
+        profiler.count("write_keyframes", "keys_written", keyframe_writer.written_count)
+        profiler.finish()
         return {"FINISHED"}
 
 class GI_delete_all_keyframes(bpy.types.Operator):
     """Deletes all keyframes with confirm dialog"""
     bl_idname = "wm.delete_all_keyframes"
     bl_label = "Delete All Keyframes"
-    bl_description = "Clears all animation data from assigned key objects"
-    bl_options = {'REGISTER', 'INTERNAL'}
+    bl_description = "Removes the keyframes this addon generated on the assigned keys (inside the frame range if one is set)"
+    bl_options = {'REGISTER', 'INTERNAL', 'UNDO'}
 
     @classmethod
     def poll(cls, context):
         return True
     def execute(self, context: bpy.types.Context):
         midi_keyframe_props = context.scene.midi_keyframe_props
-
-        for key in midi_keyframe_props.keys:
-            note_obj = key.obj
-            if note_obj == None:
-                continue
-            note_obj.animation_data_clear()
-
+        frame_range = get_frame_range(context)
+
+        # Key objects, controller targets and the instanced keyboard (hand made keys, drivers and NLA strips stay)
+        owners = {key.obj for key in midi_keyframe_props.keys if key.obj is not None}
+        owners.update(controller_target.obj for controller_target in midi_keyframe_props.controller_targets)
+        if midi_keyframe_props.keyboard_obj is not None:
+            owners.add(get_keyboard_node_group(midi_keyframe_props.keyboard_obj))
+        owners.discard(None)
+
+        removed_count = sum(remove_generated_keyframes(owner, frame_range=frame_range) for owner in owners)
+        self.report({'INFO'}, "Removed {} keyframes".format(removed_count))
+        # Everything gets generated again next time
+        midi_keyframe_props.generation_fingerprint = ""
         return {"FINISHED"}
     def invoke(self, context, event):
         return context.window_manager.invoke_confirm(self, event)
@@ -476,16 +2248,62 @@ class GI_assign_keys(bpy.types.Operator):
 
     def execute(self, context: bpy.types.Context):
         midi_keyframe_props = context.scene.midi_keyframe_props
+        keys = midi_keyframe_props.keys
+
+        report = {}
+        try:
+            key_objects = find_key_objects(context.collection, keys, midi_keyframe_props.key_name_pattern, midi_keyframe_props.key_search_children, report)
+        except re.error as error:
+            self.report({"ERROR"}, "Invalid key name pattern: {}".format(error))
+            return {"CANCELLED"}
+        for index, check_obj in key_objects.items():
+            keys[index].obj = check_obj
+
+        self.report({"INFO"}, "Assigned {} of {} keys, {} objects didn't match a key".format(len(key_objects), len(keys), len(report["unmatched"])))
+        if report["ambiguous"]:
+            self.report({"WARNING"}, "Names match several keys, add the octave (e.g. C4): {}".format(", ".join(report["ambiguous"][:10])))
+        if report["duplicates"]:
+            duplicates = ["{} ({})".format(keys[index].name, ", ".join(names)) for index, names in report["duplicates"].items()]
+            self.report({"WARNING"}, "Several objects match one key, used the first: {}".format("; ".join(duplicates[:10])))
+        return {"FINISHED"}
 
-        for check_obj in context.collection.all_objects:
-            obj_name_split = check_obj.name.split(".")
-            obj_name_key = obj_name_split[-1]
-            for key in midi_keyframe_props.keys:
-                names = key.name.split("/")
-                for name in names:
-                    if name == obj_name_key:
-                        key.obj = check_obj
+class GI_create_instanced_keyboard(bpy.types.Operator):
+    """Create instanced keyboard"""
+    bl_idname = "wm.create_instanced_keyboard"
+    bl_label = "Create Instanced Keyboard"
+    bl_description = "Creates one keyboard object that instances the keys in the selected collection with geometry nodes"
+    bl_options = {'REGISTER', 'UNDO'}
 
+    def execute(self, context: bpy.types.Context):
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        collection = context.collection
+        # Collection Info makes one instance per child collection too, their keys couldn't be told apart
+        if len(collection.children) > 0:
+            self.report({"ERROR"}, "Move the keys out of the child collections of '{}' first".format(collection.name))
+            return {"CANCELLED"}
+        # Collection Info puts instances in natural name order (e.g. "Key 2" before "Key 10")
+        key_objects = sorted(collection.objects, key=lambda obj: [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", obj.name)])
+        if len(key_objects) == 0:
+            self.report({"ERROR"}, "Selected collection has no key objects")
+            return {"CANCELLED"}
+
+        node_tree = build_keyboard_node_group("MIDI Keyboard", collection, len(key_objects))
+        keyboard_obj = bpy.data.objects.new("MIDI Keyboard", bpy.data.meshes.new("MIDI Keyboard"))
+        context.scene.collection.objects.link(keyboard_obj)
+        keyboard_obj.modifiers.new("MIDI Keyboard", 'NODES').node_group = node_tree
+
+        # Map notes to the instances of their key objects
+        instance_indices = {obj: instance_index for instance_index, obj in enumerate(key_objects)}
+        for key in midi_keyframe_props.keys:
+            key.instance_index = instance_indices.get(key.obj, -1)
+
+        # The key objects are only instanced from now on
+        collection.hide_viewport = True
+        collection.hide_render = True
+
+        midi_keyframe_props.keyboard_obj = keyboard_obj
+        midi_keyframe_props.output_target = "INSTANCES"
+        self.report({"INFO"}, "Created instanced keyboard with {} keys, hid collection '{}'".format(len(key_objects), collection.name))
         return {"FINISHED"}
 
 class GI_generate_jumping_animation(bpy.types.Operator):
@@ -507,9 +2325,14 @@ class GI_generate_jumping_animation(bpy.types.Operator):
         if midi_keyframe_props.obj_jump == None:
             return {"CANCELLED"}
 
-        # Import the MIDI file
-        print("Parsing MIDI file...") 
-        midi_file = ParsedMidiFile(midi_file_path, selected_track)
+        # Import the MIDI file (or reuse it if we parsed it before)
+        profiler = GenerationProfiler.from_settings(self.bl_idname, midi_keyframe_props)
+        with profiler.stage("load_midi"):
+            midi_file = midi_file_cache.get_parsed_track(midi_file_path, selected_track, get_timeline_cache_dir(midi_keyframe_props))
+        if midi_file is None:
+            profiler.cancel()
+            return {"CANCELLED"}
+        profiler.count("load_midi", "notes", len(midi_file.note_spans))
 
         # Debug - check for meta messages    
         # for msg in mid.tracks[int(selected_track)]:
@@ -517,11 +2340,17 @@ class GI_generate_jumping_animation(bpy.types.Operator):
         #     if not is_note:
         #         print(msg)
 
-        # Save initial keyframe
-        midi_keyframe_props.obj_jump.keyframe_insert(data_path="location", frame=0)
-
-        # Loop over each music note and animate corresponding keys
-        midi_file.for_each_key(context, animate_jump)
+        # Solve the whole path first, then write it to the location F-curves in one go
+        with profiler.stage("animate_jump"):
+            jump_path = JumpPath.from_settings(midi_file, midi_keyframe_props, context.scene.render.fps)
+        profiler.count("animate_jump", "landings", len(jump_path))
+        keyframe_writer = KeyframeWriter.from_settings(midi_keyframe_props)
+        with profiler.stage("write_keyframes"):
+            jump_path.write(midi_keyframe_props.obj_jump, keyframe_writer)
+            keyframe_writer.flush()
+        profiler.count("write_keyframes", "keys_written", keyframe_writer.written_count)
+        report_removed_keyframes(self, keyframe_writer)
+        profiler.finish()
 
         return {"FINISHED"}
 
@@ -632,115 +2461,36 @@ class InitialiseKeyList(bpy.types.Operator):
         return {"FINISHED"}
 
 # Animates objects up and down like piano keys
-def animate_keys(context, midi_note, octave: int, real_keyframe, pressed, has_release, prev_keyframe, prev_note):
-    midi_keyframe_props = context.scene.midi_keyframe_props
-    initial_state = midi_keyframe_props.initial_state
-    animation_type = midi_keyframe_props.animation_type
-    direction = midi_keyframe_props.direction
-    direction_factor = -1 if direction == "down" else 1
-    axis = int(midi_keyframe_props.axis)
-    user_octave: str = midi_keyframe_props.octave
-
-    # Skip this note if we don't care about the octave
-    # 0 = All, so if it's not all, we need to check for octave
-    if user_octave != "0":
-        # The user_octave is string, while MIDI returns int for octave 
-        if user_octave != str(octave):
-            return;
-
-
+def animate_keys(context, midi_note, start_frame, end_frame, velocity, target, keyframe_writer=None):
     # Keyframe generation
     # Get the right object corresponding to the note
-    key = get_note_key(midi_keyframe_props, midi_note)
-    key_name = key.name
-    move_obj = key.obj
+    move_obj = target.note_objects[midi_note]
     if move_obj == None:
         return
-    
-    # Save initial position as previous frame
-    match animation_type:
-        case "MOVE":
-            move_obj.location[axis] = initial_state[key_name]
-            move_obj.keyframe_insert(data_path="location", frame=real_keyframe - 1)
-
-        case "SCALE":
-            move_obj.scale = (initial_state[key_name],initial_state[key_name],initial_state[key_name])
-            move_obj.keyframe_insert(data_path="scale", frame=real_keyframe - 1)
-            
-        case "ROTATE":
-            move_obj.rotation_euler[axis] = initial_state[key_name]
-            move_obj.keyframe_insert(data_path="rotation_euler", frame=real_keyframe - 1)
-
-    # Move the object
-    match animation_type:
-        case "MOVE":
-            # Position distance is negative for pressing (since we're in Z-axis going "down")
-            # But it can be flipped by user preference
-            reverse_direction = midi_keyframe_props.travel_distance * direction_factor
-            move_distance = reverse_direction + initial_state[key_name] if pressed else initial_state[key_name]
-            move_obj.location[axis] = move_distance
-            move_obj.keyframe_insert(data_path="location", frame=real_keyframe)
-        case "SCALE":
-            # Scale "distance" is positive for pressing
-            move_distance = midi_keyframe_props.travel_distance + initial_state[key_name] if pressed else initial_state[key_name]
-            move_obj.scale = (move_distance,move_distance,move_distance)
-            move_obj.keyframe_insert(data_path="scale", frame=real_keyframe)
-        case "ROTATE":
-            # Rotation distance is positive for pressing
-            reverse_direction = midi_keyframe_props.travel_distance * direction_factor
-            move_distance = reverse_direction + initial_state[key_name] if pressed else initial_state[key_name]
-            move_obj.rotation_euler[axis] = math.radians(move_distance)
-            move_obj.keyframe_insert(data_path="rotation_euler", frame=real_keyframe)
-
-    # Does the file not have "released" notes? Create one if not
-    # TODO: Figure out proper "hold" time based on time scale
-    match animation_type:
-        case "MOVE":
-            move_obj.location[axis] = initial_state[key_name]
-            move_obj.keyframe_insert(data_path="location", frame=real_keyframe + 10)
-        case "SCALE":
-            move_obj.scale = (initial_state[key_name],initial_state[key_name],initial_state[key_name])
-            move_obj.keyframe_insert(data_path="scale", frame=real_keyframe + 10)
-        case "ROTATE":
-            move_obj.rotation_euler[axis] = initial_state[key_name]
-            move_obj.keyframe_insert(data_path="rotation_euler", frame=real_keyframe + 10)
-
-# Animates an object to "jump" between keys
-def animate_jump(context, midi_note, octave, real_keyframe, pressed, has_release, prev_keyframe, prev_note):
-    midi_keyframe_props = context.scene.midi_keyframe_props
-    # Keyframe generation
-    # Get the right object corresponding to the note
-    piano_key = get_note_key(midi_keyframe_props, midi_note).obj
-    if piano_key == None:
-        return
-    
-    move_obj = midi_keyframe_props.obj_jump
 
-    if pressed:
-        piano_key_world_pos = piano_key.matrix_world.to_translation()
+    data_path = target.note_data_paths[midi_note]
+    rest_values = target.rest_values[midi_note]
+    pressed_values = target.pressed_values[midi_note]
 
-        # Create jumping keyframes in between
-        if prev_note != None:
-            frame_between = int((real_keyframe - prev_keyframe) / 2) + prev_keyframe
-            # print("Jumping!!: {} {} {}".format(real_keyframe, prev_keyframe, frame_between))
-            prev_piano_key = get_note_key(midi_keyframe_props, prev_note).obj
-            prev_piano_key_world_pos = prev_piano_key.matrix_world.to_translation()
-            middle_distance_x = (piano_key_world_pos.x - prev_piano_key_world_pos.x)
-            move_obj.location.x = prev_piano_key_world_pos.x + middle_distance_x
-            # print("middle point x", prev_piano_key_world_pos.x + middle_distance_x)
-            move_obj.location.z += midi_keyframe_props.travel_distance
-            move_obj.keyframe_insert(data_path="location", frame=frame_between)
-            # print("Moving back down", note_letter, prev_note, prev_piano_key.name, prev_piano_key.location, prev_piano_key_world_pos.x, piano_key_world_pos.x)
-            # Place it back down
-            move_obj.location.z -= midi_keyframe_props.travel_distance
+    # Save initial position as previous frame
+    insert_keyframe(keyframe_writer, move_obj, data_path, start_frame - 1, rest_values)
+
+    # Press the key and hold it for as long as the note plays (presses win over other keys on the same frame)
+    insert_keyframe(keyframe_writer, move_obj, data_path, start_frame, pressed_values, priority=1)
+    if end_frame > start_frame:
+        insert_keyframe(keyframe_writer, move_obj, data_path, end_frame, pressed_values, priority=1)
 
+    # Release the key once the note ends
+    insert_keyframe(keyframe_writer, move_obj, data_path, end_frame + 1, rest_values)
 
-        # Move object to current key (the "down" moment)
-        # print("pressed keyframe: {}".format(real_keyframe))
-        # print("Setting jump keyframe: {} {}".format(piano_key.location.x, str(mathutils.Matrix.decompose(piano_key.matrix_world)[0])))
-        # print("Setting jump keyframe: {} {}".format(note_letter, piano_key_world_pos.x))
-        move_obj.location.x = piano_key_world_pos.x
-        move_obj.keyframe_insert(data_path="location", frame=real_keyframe)
+def animate_frame_range_boundaries(frame_range, target, keyframe_writer):
+    # Keys start and end the range at rest, presses inserted afterwards win on the same frame.
+    # This way each key is in the right state at the range boundaries without looking at notes outside of it
+    for midi_note, move_obj in enumerate(target.note_objects):
+        if move_obj is None or not target.note_mask[midi_note]:
+            continue
+        for frame in frame_range:
+            keyframe_writer.insert(move_obj, target.note_data_paths[midi_note], frame, target.rest_values[midi_note])
 
 
 
@@ -748,11 +2498,23 @@ def animate_jump(context, midi_note, octave, real_keyframe, pressed, has_release
 classes = (
     KeyItem,
     KeyList,
+    TrackTarget,
+    TrackTargetList,
+    ControllerTarget,
+    ControllerTargetList,
     GI_SceneProperties,
     GI_GamepadInputPanel,
     GI_install_midi,
     GI_generate_piano_animation,
     GI_generate_jumping_animation,
+    GI_create_instanced_keyboard,
+    GI_generate_batch_animation,
+    GI_bake_live_playback,
+    GI_add_track_target,
+    GI_remove_track_target,
+    GI_add_controller_target,
+    GI_remove_controller_target,
+    GI_generate_controller_animation,
     GI_assign_keys,
     GI_delete_all_keyframes,
     InitialiseKeyList,
@@ -764,12 +2526,22 @@ def register():
         register_class(cls)
 
     bpy.types.Scene.midi_keyframe_props = PointerProperty(type=GI_SceneProperties)
+    for handler_name, handler in live_playback_handlers:
+        getattr(bpy.app.handlers, handler_name).append(handler)
 
 def unregister():
     from bpy.utils import unregister_class
     for cls in reversed(classes):
         unregister_class(cls)
 
+    for handler_name, handler in live_playback_handlers:
+        handlers = getattr(bpy.app.handlers, handler_name)
+        if handler in handlers:
+            handlers.remove(handler)
+    for scene_name in list(live_playbacks):
+        live_playbacks.pop(scene_name)[1].restore()
+    midi_file_cache.clear()
+
 
 if __name__ == "__main__":
     register()
@@ -0,0 +1,170 @@
+# Generates animation for a whole folder of MIDI files without the UI
+#
+# blender -b --python batch.py -- --template piano.blend --midi-dir songs/ --output out/ [--settings settings.json] [--workers 4]
+#
+# MIDI files get parsed and compiled in worker processes (that part needs no `bpy`), then each song is
+# applied to a fresh copy of the template with the addon's operators and saved as its own .blend file
+# (or an action library with `--format actions`). Finished songs are tracked in `batch_progress.json`
+# inside the output folder, so running the same command again picks up where it stopped.
+#
+# The settings file is JSON with the scene settings to use, e.g.
+# {
+#     "properties": { "selected_track": "1", "animation_type": "MOVE", "speed": 1.0 },
+#     "operator": "generate_piano_animation"
+# }
+
+import argparse
+import concurrent.futures
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROGRESS_FILE_NAME = "batch_progress.json"
+
+# Worker processes only import the MIDI side, so they start without Blender
+sys.path.insert(0, PACKAGE_DIR)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate MIDI keyframes for every MIDI file in a folder")
+    parser.add_argument("--template", help="Template .blend file (defaults to the open one)")
+    parser.add_argument("--midi-dir", required=True, help="Folder with the MIDI files")
+    parser.add_argument("--output", required=True, help="Folder for the generated files and progress")
+    parser.add_argument("--settings", help="JSON file with the scene settings to use")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="How many MIDI files get compiled at once")
+    parser.add_argument("--format", choices=("blend", "actions"), default="blend", help="Save a .blend file or only the actions per song")
+    parser.add_argument("--restart", action="store_true", help="Ignore earlier progress and generate every song again")
+    # Blender passes script arguments after "--"
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    return parser.parse_args(argv)
+
+def load_settings(settings_path):
+    if settings_path is None:
+        return {}
+    with open(settings_path) as settings_file:
+        return json.load(settings_file)
+
+def load_progress(progress_path):
+    try:
+        with open(progress_path) as progress_file:
+            return json.load(progress_file)
+    except (OSError, ValueError):
+        return {"songs": {}}
+
+def save_progress(progress_path, progress):
+    temp_path = "{}.tmp".format(progress_path)
+    with open(temp_path, "w") as progress_file:
+        json.dump(progress, progress_file, indent=2, sort_keys=True)
+    os.replace(temp_path, progress_path)
+
+def load_addon():
+    import bpy
+
+    # Already installed and enabled in Blender
+    if "midi_keyframe_props" in bpy.types.Scene.bl_rna.properties:
+        return
+    spec = importlib.util.spec_from_file_location("midi_to_keyframes", os.path.join(PACKAGE_DIR, "__init__.py"), submodule_search_locations=[PACKAGE_DIR])
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = addon
+    spec.loader.exec_module(addon)
+    addon.register()
+
+def generate_song(template_path, midi_file_path, note_counts, settings, timeline_cache_dir, output_path, output_format):
+    import bpy
+
+    bpy.ops.wm.open_mainfile(filepath=template_path)
+    midi_keyframe_props = bpy.context.scene.midi_keyframe_props
+
+    properties = dict(settings.get("properties", {}))
+    # The track list depends on the MIDI file, so the track gets set last
+    selected_track = properties.pop("selected_track", None)
+    for name, value in properties.items():
+        setattr(midi_keyframe_props, name, value)
+    midi_keyframe_props.midi_file = midi_file_path
+    midi_keyframe_props.use_timeline_cache = True
+    midi_keyframe_props.timeline_cache_dir = timeline_cache_dir
+    if selected_track is None:
+        # First track with notes
+        selected_track = next((track for track, note_count in note_counts.items() if note_count > 0), None)
+        if selected_track is None:
+            raise ValueError("no notes found")
+    midi_keyframe_props.selected_track = selected_track
+
+    start_time = time.perf_counter()
+    operator = getattr(bpy.ops.wm, settings.get("operator", "generate_piano_animation"))
+    if "FINISHED" not in operator('EXEC_DEFAULT'):
+        raise RuntimeError("generating keyframes failed")
+    generate_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    if output_format == "actions":
+        bpy.data.libraries.write(output_path, set(bpy.data.actions), fake_user=True)
+    else:
+        bpy.ops.wm.save_as_mainfile(filepath=output_path, copy=True)
+    save_seconds = time.perf_counter() - start_time
+    return generate_seconds, save_seconds
+
+def main():
+    import bpy
+    from midi_timeline import compile_midi_file
+
+    args = parse_args(sys.argv)
+    template_path = os.path.abspath(args.template) if args.template else bpy.data.filepath
+    if template_path == "":
+        print("No template .blend file, pass one with --template")
+        return 1
+    settings = load_settings(args.settings)
+    load_addon()
+
+    os.makedirs(args.output, exist_ok=True)
+    timeline_cache_dir = os.path.abspath(os.path.join(args.output, "midi_cache"))
+    progress_path = os.path.join(args.output, PROGRESS_FILE_NAME)
+    progress = {"songs": {}} if args.restart else load_progress(progress_path)
+
+    # Songs that are done and still have their output are skipped
+    midi_file_names = sorted(name for name in os.listdir(args.midi_dir) if name.lower().endswith((".mid", ".midi")))
+    output_paths = {name: os.path.abspath(os.path.join(args.output, os.path.splitext(name)[0] + ".blend")) for name in midi_file_names}
+    pending_names = [name for name in midi_file_names if not (name in progress["songs"] and os.path.exists(output_paths[name]))]
+    print("{} MIDI files, {} already done".format(len(midi_file_names), len(midi_file_names) - len(pending_names)))
+
+    properties = settings.get("properties", {})
+    selected_tracks = [properties["selected_track"]] if "selected_track" in properties else None
+
+    # Compile in the background while the songs that are ready get generated here
+    failed_count = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(args.workers, 1), mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {
+            executor.submit(compile_midi_file, os.path.abspath(os.path.join(args.midi_dir, name)), selected_tracks, timeline_cache_dir): name
+            for name in pending_names
+        }
+        for done_count, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                compiled = future.result()
+                generate_seconds, save_seconds = generate_song(template_path, compiled["path"], compiled["note_counts"], settings, timeline_cache_dir, output_paths[name], args.format)
+            except Exception as error:
+                failed_count += 1
+                print("[{}/{}] {}: failed ({})".format(done_count, len(pending_names), name, error))
+                continue
+
+            progress["songs"][name] = {
+                "output": output_paths[name],
+                "compile_seconds": compiled["seconds"],
+                "generate_seconds": generate_seconds,
+                "save_seconds": save_seconds,
+            }
+            save_progress(progress_path, progress)
+            print("[{}/{}] {}: compile {:.2f}s, generate {:.2f}s, save {:.2f}s".format(
+                done_count, len(pending_names), name, compiled["seconds"], generate_seconds, save_seconds))
+
+    print("Done, {} failed".format(failed_count))
+    return 1 if failed_count > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,435 @@
+# Benchmarks for the MIDI and keyframe code paths, runs without Blender
+#
+# python benchmark.py [--events 100000] [--tracks 4] [--save-baseline]
+#
+# Generates a synthetic MIDI file (same seed = same file), then times parsing, building the timeline,
+# key presses, `animate_keys()` and the jump path. Without Blender a small in-memory `bpy` stand-in
+# is used that records keyframes and F-curve writes instead of animating anything.
+# Results are compared against `benchmark_baseline.json` (saved with --save-baseline) and the script
+# exits with an error when a benchmark got slower than the tolerance allows. Peak memory of going from
+# file bytes to key presses is measured with `tracemalloc` and has to stay under --memory-budget.
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(PACKAGE_DIR, "benchmark_baseline.json")
+TICKS_PER_BEAT = 480
+# Peak memory allowed for parsing a track and getting its key presses, in MB per million events
+DEFAULT_MEMORY_BUDGET = 96.0
+MEMORY_BUDGET_OVERHEAD = 4.0
+
+
+# ------------------------------------------------------------------------
+#    Synthetic MIDI files
+# ------------------------------------------------------------------------
+
+def encode_variable_int(value):
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value > 0:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+def encode_track(events):
+    # events are (tick, order, message bytes), order keeps note offs before note ons on the same tick
+    data = bytearray()
+    last_tick = 0
+    for tick, order, message in sorted(events):
+        data += encode_variable_int(tick - last_tick)
+        data += message
+        last_tick = tick
+    data += b"\x00\xff\x2f\x00"
+    return b"MTrk" + struct.pack(">L", len(data)) + bytes(data)
+
+def generate_midi_file(path, events=100000, tracks=4, density=4, polyphony=3, tempo_changes=16, seed=0):
+    """Writes a MIDI file with about `events` note events spread over `tracks` note tracks
+
+    `density` is chords per beat and `polyphony` notes per chord, the first track only has tempo changes.
+    """
+    rng = random.Random(seed)
+    chords_per_track = max(events // (2 * polyphony * max(tracks, 1)), 1)
+    song_ticks = chords_per_track * TICKS_PER_BEAT // density
+
+    tempo_events = []
+    for index in range(tempo_changes):
+        tempo = rng.randint(300000, 900000)
+        tempo_events.append((index * song_ticks // max(tempo_changes, 1), 0, b"\xff\x51\x03" + tempo.to_bytes(3, "big")))
+    track_chunks = [encode_track(tempo_events)]
+
+    for track in range(tracks):
+        channel = track % 16
+        note_events = []
+        for chord in range(chords_per_track):
+            tick = chord * TICKS_PER_BEAT // density
+            for midi_note in rng.sample(range(21, 109), polyphony):
+                length = rng.randint(TICKS_PER_BEAT // 8, TICKS_PER_BEAT * 2)
+                note_events.append((tick, 1, bytes((0x90 | channel, midi_note, rng.randint(1, 127)))))
+                # Mix real note offs and note ons with 0 velocity
+                if rng.random() < 0.5:
+                    note_events.append((tick + length, 0, bytes((0x80 | channel, midi_note, 64))))
+                else:
+                    note_events.append((tick + length, 0, bytes((0x90 | channel, midi_note, 0))))
+        track_chunks.append(encode_track(note_events))
+
+    with open(path, "wb") as midi_file:
+        midi_file.write(b"MThd" + struct.pack(">LhhH", 6, 1, len(track_chunks), TICKS_PER_BEAT))
+        for chunk in track_chunks:
+            midi_file.write(chunk)
+    return path
+
+
+# ------------------------------------------------------------------------
+#    bpy stand-in
+# ------------------------------------------------------------------------
+
+class FakeVector(list):
+    x = property(lambda self: self[0], lambda self, value: self.__setitem__(0, value))
+    y = property(lambda self: self[1], lambda self, value: self.__setitem__(1, value))
+    z = property(lambda self: self[2], lambda self, value: self.__setitem__(2, value))
+
+class FakeMatrix:
+    def __init__(self, translation) -> None:
+        self.translation = translation
+
+    def to_translation(self):
+        return FakeVector(self.translation)
+
+class FakeKeyframePoints:
+    def __init__(self) -> None:
+        self.coords = []
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __iter__(self):
+        return iter([types.SimpleNamespace(co=self.coords[index:index + 2]) for index in range(0, len(self.coords), 2)])
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def add(self, count):
+        self.coords += [0.0] * (count * 2)
+
+    def foreach_get(self, name, values):
+        values[:] = self.coords
+
+    def foreach_set(self, name, values):
+        self.coords = list(values)
+
+    def clear(self):
+        self.coords = []
+
+    def remove(self, point, fast=False):
+        for index in range(0, len(self.coords), 2):
+            if self.coords[index] == point.co[0]:
+                del self.coords[index:index + 2]
+                return
+
+class FakeFCurve:
+    def __init__(self, data_path, index) -> None:
+        self.data_path = data_path
+        self.array_index = index
+        self.keyframe_points = FakeKeyframePoints()
+
+    def update(self):
+        coords = self.keyframe_points.coords
+        points = sorted(zip(coords[0::2], coords[1::2]))
+        self.keyframe_points.coords = [value for point in points for value in point]
+
+class FakeFCurves(list):
+    def find(self, data_path, index=0):
+        return next((fcurve for fcurve in self if fcurve.data_path == data_path and fcurve.array_index == index), None)
+
+    def new(self, data_path, index=0, action_group=""):
+        fcurve = FakeFCurve(data_path, index)
+        self.append(fcurve)
+        return fcurve
+
+class FakeAction:
+    def __init__(self, name) -> None:
+        self.name = name
+        self.fcurves = FakeFCurves()
+        self.properties = {}
+
+    # Custom properties
+    def get(self, name, default=None):
+        return self.properties.get(name, default)
+
+    def __setitem__(self, name, value):
+        self.properties[name] = value
+
+class FakeObject:
+    """Key object that records what gets keyframed"""
+    id_type = "OBJECT"
+    data_collection = "objects"
+
+    def __init__(self, name, location=(0.0, 0.0, 0.0)) -> None:
+        self.name = name
+        self.location = FakeVector(location)
+        self.scale = FakeVector((1.0, 1.0, 1.0))
+        self.rotation_euler = FakeVector((0.0, 0.0, 0.0))
+        self.matrix_world = FakeMatrix(location)
+        self.animation_data = None
+        # (data path, frame, value) for each `keyframe_insert()`
+        self.inserted_keyframes = []
+        # Findable by name like real IDs (the newest one wins on the same name)
+        getattr(sys.modules["bpy"].data, self.data_collection)[name] = self
+
+    def __setattr__(self, name, value):
+        if name in ("location", "scale", "rotation_euler"):
+            value = FakeVector(value)
+        super().__setattr__(name, value)
+
+    def keyframe_insert(self, data_path, frame):
+        self.inserted_keyframes.append((data_path, frame, list(getattr(self, data_path))))
+
+    def animation_data_create(self):
+        self.animation_data = types.SimpleNamespace(action=None)
+
+class FakeNodeTree(FakeObject):
+    """Node group of an instanced keyboard, `nodes` maps node names to simple stand-ins"""
+    id_type = "NODETREE"
+    data_collection = "node_groups"
+
+    def __init__(self, name, nodes) -> None:
+        super().__init__(name)
+        self.nodes = nodes
+
+class FakeScenes(list):
+    def get(self, name, default=None):
+        return next((scene for scene in self if scene.name == name), default)
+
+def install_fake_bpy():
+    """Puts a minimal `bpy` into `sys.modules`, enough to import the addon and run its animation code"""
+    def prop(*args, **kwargs):
+        return None
+
+    class Base:
+        pass
+
+    bpy = types.ModuleType("bpy")
+    bpy.types = types.ModuleType("bpy.types")
+    for name in ("PropertyGroup", "Operator", "Panel", "UIList", "Object", "Collection", "Action", "Context", "Scene"):
+        setattr(bpy.types, name, Base)
+    bpy.props = types.ModuleType("bpy.props")
+    for name in ("StringProperty", "BoolProperty", "FloatProperty", "EnumProperty", "PointerProperty", "IntProperty", "CollectionProperty", "FloatVectorProperty"):
+        setattr(bpy.props, name, prop)
+    bpy.app = types.ModuleType("bpy.app")
+    bpy.app.handlers = types.ModuleType("bpy.app.handlers")
+    bpy.app.handlers.persistent = lambda function: function
+    for handler_name in ("frame_change_post", "load_pre", "undo_post", "redo_post", "save_pre", "save_post"):
+        setattr(bpy.app.handlers, handler_name, [])
+    bpy.data = types.SimpleNamespace(filepath="", actions=types.SimpleNamespace(new=lambda name: FakeAction(name)), objects={}, node_groups={}, scenes=FakeScenes())
+    bpy.utils = types.SimpleNamespace(register_class=lambda cls: None, unregister_class=lambda cls: None)
+    bpy.ops = types.SimpleNamespace()
+
+    sys.modules.update({
+        "bpy": bpy,
+        "bpy.types": bpy.types,
+        "bpy.props": bpy.props,
+        "bpy.app": bpy.app,
+        "bpy.app.handlers": bpy.app.handlers,
+    })
+
+def load_addon():
+    try:
+        import bpy
+    except ImportError:
+        install_fake_bpy()
+    spec = importlib.util.spec_from_file_location("midi_to_keyframes", os.path.join(PACKAGE_DIR, "__init__.py"), submodule_search_locations=[PACKAGE_DIR])
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = addon
+    spec.loader.exec_module(addon)
+    return addon
+
+def make_context(addon, fps=30, midi_file=""):
+    # Scene settings with a key object for every piano key, laid out like a keyboard
+    keys = [types.SimpleNamespace(name=name, obj=FakeObject(name, (index * 0.2, 0.0, 0.0)), instance_index=-1) for index, (midi_note, name) in enumerate(addon.InitialiseKeyList.midi_notes)]
+    midi_keyframe_props = types.SimpleNamespace(
+        midi_file=midi_file, selected_track="1",
+        keys=keys, speed=1.0, animation_type="MOVE", axis="2", direction="down", travel_distance=1.0, octave="0",
+        simplify_keyframes=True, simplify_tolerance=0.0001, output_target="OBJECTS", keyboard_obj=None,
+        obj_jump=FakeObject("Jump"), jump_chord_target="CENTER", jump_height_mode="FIXED", jump_height_scale=0.5,
+        frame_range="ALL", frame_range_start=1, frame_range_end=250, incremental_generation=True, generation_fingerprint="", time_budget=20.0,
+        profile_generation=False, profile_cprofile=False, profile_report_path="", use_timeline_cache=False, timeline_cache_dir="",
+        key_name_pattern=addon.DEFAULT_KEY_NAME_PATTERN, key_search_children=True,
+        track_targets=[], controller_targets=[], controller_tolerance=0.005, live_playback=False,
+    )
+    scenes = sys.modules["bpy"].data.scenes
+    scene = types.SimpleNamespace(
+        name="Scene.{:03}".format(len(scenes)), render=types.SimpleNamespace(fps=fps),
+        frame_start=1, frame_end=250, frame_current=1, use_preview_range=False,
+        midi_keyframe_props=midi_keyframe_props)
+    scenes.append(scene)
+    return types.SimpleNamespace(scene=scene)
+
+
+# ------------------------------------------------------------------------
+#    Benchmarks
+# ------------------------------------------------------------------------
+
+def get_benchmarks(addon, midi_file_path, selected_track):
+    midi_timeline = sys.modules[addon.__name__ + ".midi_timeline"]
+    parsed = midi_timeline.ParsedMidiFile(midi_file_path, selected_track)
+
+    def parse():
+        # Decode every event of every track
+        reader = midi_timeline.MidiFileReader(midi_file_path)
+        for track in range(len(reader.track_chunks)):
+            for event in reader.iter_events(track):
+                pass
+
+    def build_timeline():
+        midi_timeline.ParsedMidiFile(midi_file_path, selected_track)
+
+    def key_presses():
+        # Frame columns and pairing presses, without the cached frames of the last run
+        parsed.note_spans.frames_key = None
+        parsed.get_key_presses(30, 1.0)
+
+    def animate_keys_bulk():
+        context = make_context(addon)
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        target = addon.KeyAnimationTarget.from_keys(midi_keyframe_props, midi_keyframe_props.keys)
+        keyframe_writer = addon.KeyframeWriter.from_settings(midi_keyframe_props)
+        for key_press in parsed.get_key_presses(context.scene.render.fps, midi_keyframe_props.speed, target.note_mask):
+            addon.animate_keys(context, *key_press, target=target, keyframe_writer=keyframe_writer)
+        keyframe_writer.flush()
+
+    def animate_keys_insert():
+        context = make_context(addon)
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        target = addon.KeyAnimationTarget.from_keys(midi_keyframe_props, midi_keyframe_props.keys)
+        for key_press in parsed.get_key_presses(context.scene.render.fps, midi_keyframe_props.speed, target.note_mask):
+            addon.animate_keys(context, *key_press, target=target)
+
+    def animate_jump():
+        context = make_context(addon)
+        midi_keyframe_props = context.scene.midi_keyframe_props
+        keyframe_writer = addon.KeyframeWriter.from_settings(midi_keyframe_props)
+        jump_path = addon.JumpPath.from_settings(parsed, midi_keyframe_props, context.scene.render.fps)
+        jump_path.write(midi_keyframe_props.obj_jump, keyframe_writer)
+        keyframe_writer.flush()
+
+    return {
+        "parse": parse,
+        "build_timeline": build_timeline,
+        "key_presses": key_presses,
+        "animate_keys_bulk": animate_keys_bulk,
+        "animate_keys_insert": animate_keys_insert,
+        "animate_jump": animate_jump,
+    }
+
+def measure_peak_memory(addon, midi_file_path, selected_track):
+    """Peak traced memory (in bytes) and event count for going from the file to every key press"""
+    midi_timeline = sys.modules[addon.__name__ + ".midi_timeline"]
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            parsed = midi_timeline.ParsedMidiFile(midi_file_path, selected_track)
+        for key_press in parsed.get_key_presses(30, 1.0):
+            pass
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak_memory, len(parsed.timeline)
+
+def get_memory_budget(event_count, memory_budget=DEFAULT_MEMORY_BUDGET):
+    # In MB, plus a bit for what every file needs regardless of its size
+    return memory_budget * event_count / 1000000 + MEMORY_BUDGET_OVERHEAD
+
+def run_benchmark(benchmark, repeat):
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            benchmark()
+            timings.append(time.perf_counter() - start_time)
+    return {"min": min(timings), "median": statistics.median(timings)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MIDI and keyframe code paths")
+    parser.add_argument("--events", type=int, default=100000, help="Note events in the generated file")
+    parser.add_argument("--tracks", type=int, default=4, help="Note tracks in the generated file")
+    parser.add_argument("--density", type=int, default=4, help="Chords per beat")
+    parser.add_argument("--polyphony", type=int, default=3, help="Notes per chord")
+    parser.add_argument("--tempo-changes", type=int, default=16, help="Tempo changes over the song")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed, the same seed generates the same file")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark")
+    parser.add_argument("--only", nargs="*", help="Only run these benchmarks")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="How much slower than the baseline is still fine (0.25 = 25%%)")
+    parser.add_argument("--memory-budget", type=float, default=DEFAULT_MEMORY_BUDGET, help="Peak MB per million events allowed for parsing and key presses")
+    args = parser.parse_args()
+
+    addon = load_addon()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        midi_file_path = generate_midi_file(
+            os.path.join(temp_dir, "benchmark.mid"),
+            events=args.events, tracks=args.tracks, density=args.density, polyphony=args.polyphony,
+            tempo_changes=args.tempo_changes, seed=args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmarks = get_benchmarks(addon, midi_file_path, "1")
+
+        # Baselines only make sense for the same file
+        file_key = "events={} tracks={} density={} polyphony={} tempo_changes={} seed={}".format(
+            args.events, args.tracks, args.density, args.polyphony, args.tempo_changes, args.seed)
+        results = {}
+        for name, benchmark in benchmarks.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = run_benchmark(benchmark, args.repeat)
+        peak_memory, event_count = measure_peak_memory(addon, midi_file_path, "1")
+
+    try:
+        with open(args.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+    except (OSError, ValueError):
+        baselines = {}
+    baseline = baselines.get(file_key, {})
+
+    regressions = []
+    print("{:<22} {:>10} {:>10} {:>10}".format("benchmark", "min (ms)", "median", "baseline"))
+    for name, result in results.items():
+        baseline_median = baseline.get(name, {}).get("median")
+        print("{:<22} {:>10.2f} {:>10.2f} {:>10}".format(
+            name, result["min"] * 1000, result["median"] * 1000,
+            "{:.2f}".format(baseline_median * 1000) if baseline_median is not None else "-"))
+        if baseline_median is not None and result["median"] > baseline_median * (1 + args.tolerance):
+            regressions.append(name)
+
+    peak_mb = peak_memory / 1024 / 1024
+    memory_budget = get_memory_budget(event_count, args.memory_budget)
+    print("Peak memory: {:.1f} MB for {} events (budget {:.1f} MB)".format(peak_mb, event_count, memory_budget))
+    over_budget = peak_mb > memory_budget
+    if over_budget:
+        print("Over the memory budget")
+
+    if args.save_baseline:
+        baselines[file_key] = results
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        print("Saved baseline to {}".format(args.baseline))
+    elif regressions:
+        print("Slower than the baseline: {}".format(", ".join(regressions)))
+        return 1
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
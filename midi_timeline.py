@@ -0,0 +1,733 @@
+# MIDI parsing and timelines, no `bpy` in here so it also runs outside of Blender (e.g. batch worker processes)
+
+import bisect
+import itertools
+from array import array
+import hashlib
+import io
+import mmap
+import struct
+import sys
+import os
+import time
+
+# Constants
+
+DEFAULT_TEMPO = 500000
+# On-disk timeline cache files, bump the version when the layout changes
+TIMELINE_CACHE_MAGIC = b"MIDITLNE"
+TIMELINE_CACHE_VERSION = 4
+TIMELINE_CACHE_EXTENSION = ".timeline"
+# magic, version, byte order, content hash, ticks per beat, total time, has release, event count, tempo count, note count
+TIMELINE_CACHE_HEADER = struct.Struct("<8sHB16sIQBQQQ")
+# Presses of the same key closer than this (in frames) become one long press,
+# since a key needs a frame to come up and another to go down again
+KEY_PRESS_MIN_GAP = 2.0
+# Controller number used for pitch bend, which has its own message type instead of a control change
+PITCH_BEND_CONTROLLER = -1
+
+def get_note_octave(midi_note):
+    octave = round(midi_note / 12)
+    return octave
+
+class MidiFileReader:
+    """Minimal Standard MIDI File reader that only decodes the tracks we actually use"""
+    # Data bytes for system common messages, the rest are undefined in MIDI files
+    system_lengths = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+    def __init__(self, midi_file_path) -> None:
+        with open(midi_file_path, "rb") as midi_file:
+            self.data = midi_file.read()
+
+        data = self.data
+        if data[:4] != b"MThd" or len(data) < 14:
+            raise OSError("MThd not found. Probably not a MIDI file")
+        header_size = struct.unpack_from(">L", data, 4)[0]
+        self.type, track_count, self.ticks_per_beat = struct.unpack_from(">hhh", data, 8)
+
+        # Only read chunk headers, so tracks we never use are skipped by their length
+        self.track_chunks = []
+        offset = 8 + header_size
+        while offset + 8 <= len(data) and len(self.track_chunks) < track_count:
+            name, size = struct.unpack_from(">4sL", data, offset)
+            offset += 8
+            if name == b"MTrk":
+                self.track_chunks.append((offset, min(offset + size, len(data))))
+            offset += size
+
+    def read_variable_int(self, offset):
+        data = self.data
+        value = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value = (value << 7) | (byte & 0x7F)
+            if byte < 0x80:
+                return value, offset
+
+    def iter_events(self, track):
+        """Yields (tick, status, data1, data2) for every event in a track
+
+        Channel messages have their data bytes (data2 is None for 1 byte messages),
+        meta events have the meta type and payload, sysex events have the payload in data2.
+        """
+        data = self.data
+        offset, end = self.track_chunks[int(track)]
+        tick = 0
+        last_status = None
+
+        while offset < end:
+            delta, offset = self.read_variable_int(offset)
+            tick += delta
+            status = data[offset]
+            offset += 1
+
+            # Running status reuses the last status byte
+            if status < 0x80:
+                if last_status is None:
+                    raise OSError("running status without last_status")
+                status = last_status
+                offset -= 1
+            elif status != 0xFF:
+                # Meta messages don't set running status
+                last_status = status
+
+            if status == 0xFF:
+                meta_type = data[offset]
+                length, offset = self.read_variable_int(offset + 1)
+                yield tick, status, meta_type, data[offset:offset + length]
+                offset += length
+            elif status == 0xF0 or status == 0xF7:
+                length, offset = self.read_variable_int(offset)
+                yield tick, status, None, data[offset:offset + length]
+                offset += length
+            elif status < 0xF0:
+                if 0xC0 <= status < 0xE0:
+                    yield tick, status, data[offset], None
+                    offset += 1
+                else:
+                    yield tick, status, data[offset], data[offset + 1]
+                    offset += 2
+            else:
+                length = self.system_lengths.get(status)
+                if length is None:
+                    raise OSError("undefined status byte 0x{:02x}".format(status))
+                yield tick, status, data[offset] if length > 0 else None, data[offset + 1] if length > 1 else None
+                offset += length
+
+    def scan_track(self, track):
+        # Only reads events until we have the track name and know it plays something
+        track_name = ""
+        for tick, status, data1, data2 in self.iter_events(track):
+            if status == 0xFF:
+                if data1 == 0x03 and track_name == "":
+                    track_name = data2.decode("latin-1")
+            elif status < 0xF0:
+                return TrackInfo(track, track_name, True)
+        return TrackInfo(track, track_name, False)
+
+    def iter_tempo_changes(self, track):
+        # Most tracks have no tempo events at all, so look for one before decoding the track
+        offset, end = self.track_chunks[int(track)]
+        if self.data.find(b"\xff\x51\x03", offset, end) == -1:
+            return
+        for tick, status, meta_type, payload in self.iter_events(track):
+            if status == 0xFF and meta_type == 0x51 and len(payload) == 3:
+                yield tick, (payload[0] << 16) | (payload[1] << 8) | payload[2]
+
+    def verify_against_mido(self):
+        """Compares what we read with `mido` and returns a list of differences"""
+        from mido import MidiFile
+        midi = MidiFile(file=io.BytesIO(self.data))
+        errors = []
+        if len(midi.tracks) != len(self.track_chunks):
+            errors.append("track count {} != {}".format(len(self.track_chunks), len(midi.tracks)))
+        for track, mido_track in enumerate(midi.tracks[:len(self.track_chunks)]):
+            expected = []
+            tick = 0
+            for msg in mido_track:
+                tick += msg.time
+                expected.append((tick, msg.bytes()))
+            events = [(tick, self.get_event_bytes(status, data1, data2)) for tick, status, data1, data2 in self.iter_events(track)]
+            if events != expected:
+                mismatch = next((i for i, (event, msg) in enumerate(zip(events, expected)) if event != msg), min(len(events), len(expected)))
+                errors.append("track {} differs at event {}".format(track, mismatch))
+        return errors
+
+    def get_event_bytes(self, status, data1, data2):
+        # Same layout as `mido.Message.bytes()`
+        if status == 0xFF:
+            length = []
+            size = len(data2)
+            while True:
+                length.insert(0, (size & 0x7F) | (0x80 if length else 0))
+                size >>= 7
+                if size == 0:
+                    break
+            return [status, data1] + length + list(data2)
+        if status == 0xF0 or status == 0xF7:
+            payload = list(data2)
+            if payload and payload[0] == 0xF0:
+                payload = payload[1:]
+            if payload and payload[-1] == 0xF7:
+                payload = payload[:-1]
+            return [0xF0] + payload + [0xF7]
+        return [byte for byte in (status, data1, data2) if byte is not None]
+
+class TempoMap:
+    """Tempo changes as cumulative breakpoints for converting ticks to seconds"""
+
+    def __init__(self, ticks_per_beat, tempo_changes) -> None:
+        self.ticks_per_beat = ticks_per_beat
+        # Breakpoint columns: where each tempo starts (in ticks and seconds) and its tempo
+        self.ticks = array("Q", [0])
+        self.seconds = array("d", [0.0])
+        self.tempos = array("I", [DEFAULT_TEMPO])
+
+        # Tempo changes are sorted by tick, later changes on the same tick win
+        for tick, tempo in sorted(tempo_changes, key=lambda change: change[0]):
+            if tick == self.ticks[-1]:
+                self.tempos[-1] = tempo
+                continue
+            self.seconds.append(self.seconds[-1] + (tick - self.ticks[-1]) * self.tempos[-1] * 1e-6 / ticks_per_beat)
+            self.ticks.append(tick)
+            self.tempos.append(tempo)
+
+    @classmethod
+    def from_reader(cls, reader, selected_track):
+        # Type 0 and 1 files share one tempo map across all tracks,
+        # type 2 files have an independent tempo per track
+        tracks = range(len(reader.track_chunks)) if reader.type != 2 else [int(selected_track)]
+        tempo_changes = []
+        for track in tracks:
+            tempo_changes.extend(reader.iter_tempo_changes(track))
+        return cls(reader.ticks_per_beat, tempo_changes)
+
+    def ticks_to_seconds(self, ticks):
+        # Walk the breakpoints along with the ticks, they're sorted for events and note starts.
+        # Speed gets applied when converting to frames. Ticks that go back (note ends) bisect instead
+        breakpoint_ticks = self.ticks
+        breakpoint_seconds = self.seconds
+        scales = [tempo * 1e-6 / self.ticks_per_beat for tempo in self.tempos]
+        last_breakpoint = len(breakpoint_ticks) - 1
+        seconds = array("d", [0.0]) * len(ticks)
+        breakpoint = 0
+        for index, tick in enumerate(ticks):
+            if tick < breakpoint_ticks[breakpoint]:
+                breakpoint = bisect.bisect_right(breakpoint_ticks, tick) - 1
+            while breakpoint < last_breakpoint and breakpoint_ticks[breakpoint + 1] <= tick:
+                breakpoint += 1
+            seconds[index] = breakpoint_seconds[breakpoint] + (tick - breakpoint_ticks[breakpoint]) * scales[breakpoint]
+        return seconds
+
+class NoteTimeline:
+    """Note on/off events of a single track, stored as compact columns"""
+
+    def __init__(self) -> None:
+        # One entry per note event, all columns share the same index
+        self.ticks = array("Q")
+        self.seconds = array("d")
+        self.notes = array("B")
+        self.velocities = array("B")
+        self.pressed = array("B")
+        self.channels = array("B")
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def add_event(self, tick, channel, note, velocity, pressed):
+        self.ticks.append(tick)
+        self.channels.append(channel)
+        self.notes.append(note)
+        self.velocities.append(velocity)
+        self.pressed.append(pressed)
+
+    def compile_seconds(self, tempo_map):
+        self.seconds = tempo_map.ticks_to_seconds(self.ticks)
+
+class NoteSpans:
+    """Notes paired from their on/off events, with real start and end times"""
+
+    def __init__(self) -> None:
+        # One entry per note, sorted by start time
+        self.start_ticks = array("Q")
+        self.end_ticks = array("Q")
+        self.start_seconds = array("d")
+        self.end_seconds = array("d")
+        self.notes = array("B")
+        self.velocities = array("B")
+        self.channels = array("B")
+        # Cached frame columns for the last fps/speed combination
+        self.frames_key = None
+        self.start_frames = array("d")
+        self.end_frames = array("d")
+        # Latest end frame of all notes up to each index, never decreases so it can be bisected
+        self.max_end_frames = array("d")
+
+    def __len__(self):
+        return len(self.start_ticks)
+
+    @classmethod
+    def from_timeline(cls, timeline, tempo_map):
+        spans = cls()
+        # Indices of notes still held, per (channel, pitch), the most recent on top
+        open_notes = {}
+        # Where the next note on the same (channel, pitch) starts, only kept for notes that are still held
+        # (the ones that might never get released)
+        next_starts = {}
+        last_started = {}
+
+        for tick, channel, note, velocity, pressed in zip(timeline.ticks, timeline.channels, timeline.notes, timeline.velocities, timeline.pressed):
+            note_key = (channel, note)
+            # A `note_on` with 0 velocity is a `note_off`
+            if pressed and velocity > 0:
+                index = len(spans.start_ticks)
+                stack = open_notes.setdefault(note_key, [])
+                # The most recent note on this key is on top of the stack while it's held
+                if stack and stack[-1] == last_started.get(note_key):
+                    next_starts[stack[-1]] = tick
+                stack.append(index)
+                last_started[note_key] = index
+
+                spans.start_ticks.append(tick)
+                spans.end_ticks.append(tick)
+                spans.notes.append(note)
+                spans.velocities.append(velocity)
+                spans.channels.append(channel)
+            elif open_notes.get(note_key):
+                spans.end_ticks[open_notes[note_key].pop()] = tick
+
+        # Notes without a `note_off` are held for a beat (or until the same note plays again)
+        for stack in open_notes.values():
+            for index in stack:
+                end_tick = spans.start_ticks[index] + tempo_map.ticks_per_beat
+                spans.end_ticks[index] = min(end_tick, next_starts.get(index, end_tick))
+
+        spans.start_seconds = tempo_map.ticks_to_seconds(spans.start_ticks)
+        spans.end_seconds = tempo_map.ticks_to_seconds(spans.end_ticks)
+        return spans
+
+    def get_frames(self, fps, speed):
+        if self.frames_key != (fps, speed):
+            # Generators instead of lists, so there's no temporary float object per note
+            self.start_frames = array("d", ((seconds * speed * fps) + 1 for seconds in self.start_seconds))
+            self.end_frames = array("d", ((seconds * speed * fps) + 1 for seconds in self.end_seconds))
+            self.max_end_frames = array("d", itertools.accumulate(self.end_frames, max))
+            self.frames_key = (fps, speed)
+        return self.start_frames, self.end_frames
+
+    def get_window_indices(self, fps, speed, first_frame, last_frame):
+        # Notes playing anywhere between the two frames, found by bisecting instead of walking the whole track
+        start_frames, end_frames = self.get_frames(fps, speed)
+        first_index = bisect.bisect_left(self.max_end_frames, first_frame)
+        last_index = bisect.bisect_right(start_frames, last_frame)
+        return [index for index in range(first_index, last_index) if end_frames[index] >= first_frame]
+
+    def get_span_indices(self, note_mask=None, indices=None):
+        # Drops masked out notes in bulk, `note_mask` has a flag for each of the 128 notes.
+        # Whole tracks get an iterator, so there's no list with an int per note
+        if indices is None:
+            if note_mask is None:
+                return range(len(self))
+            return itertools.compress(range(len(self)), map(note_mask.__getitem__, self.notes))
+        if note_mask is None:
+            return indices
+        return [index for index in indices if note_mask[self.notes[index]]]
+
+class KeyPresses:
+    """Key presses stored as packed columns (18 bytes each instead of a list with 4 objects)
+
+    Iterating yields (note, start frame, end frame, velocity) tuples one at a time.
+    """
+    __slots__ = ("notes", "start_frames", "end_frames", "velocities")
+
+    def __init__(self) -> None:
+        self.notes = array("B")
+        self.start_frames = array("d")
+        self.end_frames = array("d")
+        self.velocities = array("B")
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __iter__(self):
+        return zip(self.notes, self.start_frames, self.end_frames, self.velocities)
+
+    def append(self, note, start_frame, end_frame, velocity):
+        self.notes.append(note)
+        self.start_frames.append(start_frame)
+        self.end_frames.append(end_frame)
+        self.velocities.append(velocity)
+
+class ParsedMidiFile:
+    total_time = 0
+    has_release = False
+    tempo = DEFAULT_TEMPO
+    tempo_map = None
+    selected_track = 0
+    timeline = None
+    note_spans = None
+
+    def __init__(self, midi_file_path, selected_track, reader=None) -> None:
+        self.selected_track = selected_track
+
+        # Read the file unless we got an already opened one (e.g. from the cache)
+        if reader is None:
+            print("Loading MIDI file...") 
+            reader = MidiFileReader(midi_file_path)
+        
+        # Collect every tempo change so timing stays right when the tempo changes mid-song
+        self.tempo_map = TempoMap.from_reader(reader, selected_track)
+        self.tempo = self.tempo_map.tempos[0]
+
+        self.compile_timeline(reader)
+
+    def compile_timeline(self, reader):
+        # Stream the selected track once and keep only what the animations need
+        self.timeline = NoteTimeline()
+        for tick, status, data1, data2 in reader.iter_events(self.selected_track):
+            # Figure out total time
+            self.total_time = tick
+
+            # Skip metadata and everything that isn't a note
+            message_type = status & 0xF0
+            if status >= 0xF0:
+                continue
+            if message_type == 0x90:
+                self.timeline.add_event(tick, status & 0x0F, data1, data2, True)
+            elif message_type == 0x80:
+                self.timeline.add_event(tick, status & 0x0F, data1, data2, False)
+                # We also see if there's any stopping points using `note_off`
+                # If missing - we assume notes are held for 1 second (like 1 block in FLStudio)
+                self.has_release = True
+
+        self.timeline.compile_seconds(self.tempo_map)
+        self.note_spans = NoteSpans.from_timeline(self.timeline, self.tempo_map)
+
+    def get_timeline_columns(self):
+        timeline = self.timeline
+        tempo_map = self.tempo_map
+        spans = self.note_spans
+        # 8 byte columns first so every column stays aligned
+        return (timeline.ticks, timeline.seconds, tempo_map.ticks, tempo_map.seconds,
+                spans.start_ticks, spans.end_ticks, spans.start_seconds, spans.end_seconds, tempo_map.tempos,
+                timeline.notes, timeline.velocities, timeline.pressed, timeline.channels,
+                spans.notes, spans.velocities, spans.channels)
+
+    def set_timeline_columns(self, columns):
+        timeline = self.timeline
+        tempo_map = self.tempo_map
+        spans = self.note_spans
+        (timeline.ticks, timeline.seconds, tempo_map.ticks, tempo_map.seconds,
+         spans.start_ticks, spans.end_ticks, spans.start_seconds, spans.end_seconds, tempo_map.tempos,
+         timeline.notes, timeline.velocities, timeline.pressed, timeline.channels,
+         spans.notes, spans.velocities, spans.channels) = columns
+
+    def save_timeline(self, cache_path, content_hash):
+        header = TIMELINE_CACHE_HEADER.pack(
+            TIMELINE_CACHE_MAGIC, TIMELINE_CACHE_VERSION, sys.byteorder == "little", content_hash,
+            self.tempo_map.ticks_per_beat, self.total_time, self.has_release,
+            len(self.timeline), len(self.tempo_map.ticks), len(self.note_spans))
+
+        # Write to a temp file first so other processes never see a half written cache
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(temp_path, "wb") as cache_file:
+            cache_file.write(header)
+            for column in self.get_timeline_columns():
+                column.tofile(cache_file)
+        os.replace(temp_path, cache_path)
+
+    @classmethod
+    def load_timeline(cls, cache_path, content_hash, selected_track):
+        # Returns None if there's no valid cache file, so we can parse the MIDI file instead
+        try:
+            with open(cache_path, "rb") as cache_file:
+                cache_data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        parsed = cls.map_timeline(cache_data, content_hash, selected_track)
+        if parsed is None:
+            cache_data.close()
+        return parsed
+
+    @classmethod
+    def map_timeline(cls, cache_data, content_hash, selected_track):
+        # The columns are views into the mapped file, so nothing gets copied or computed until it's used.
+        # The mapping stays open for as long as a column is still around
+        if len(cache_data) < TIMELINE_CACHE_HEADER.size:
+            return None
+        (magic, version, little_endian, file_hash, ticks_per_beat, total_time, has_release,
+         event_count, tempo_count, note_count) = TIMELINE_CACHE_HEADER.unpack_from(cache_data)
+        if magic != TIMELINE_CACHE_MAGIC or version != TIMELINE_CACHE_VERSION or bool(little_endian) != (sys.byteorder == "little") or file_hash != content_hash:
+            return None
+
+        parsed = cls.__new__(cls)
+        parsed.selected_track = selected_track
+        parsed.total_time = total_time
+        parsed.has_release = bool(has_release)
+        parsed.tempo_map = TempoMap(ticks_per_beat, [])
+        parsed.timeline = NoteTimeline()
+        parsed.note_spans = NoteSpans()
+
+        lengths = (event_count, event_count, tempo_count, tempo_count,
+                   note_count, note_count, note_count, note_count, tempo_count,
+                   event_count, event_count, event_count, event_count,
+                   note_count, note_count, note_count)
+        empty_columns = parsed.get_timeline_columns()
+        if TIMELINE_CACHE_HEADER.size + sum(column.itemsize * length for column, length in zip(empty_columns, lengths)) != len(cache_data):
+            return None
+        view = memoryview(cache_data)
+        offset = TIMELINE_CACHE_HEADER.size
+        columns = []
+        for column, length in zip(empty_columns, lengths):
+            end = offset + column.itemsize * length
+            columns.append(view[offset:end].cast(column.typecode))
+            offset = end
+        parsed.set_timeline_columns(columns)
+        parsed.tempo = parsed.tempo_map.tempos[0]
+        return parsed
+
+    def get_key_presses(self, fps, speed, note_mask=None, min_gap=KEY_PRESS_MIN_GAP, frame_range=None):
+        """Returns `KeyPresses` with (note, start frame, end frame, velocity) for each key press, sorted by start
+
+        Notes on the same key that overlap or are less than `min_gap` frames apart
+        become one press, so the key stays down instead of jittering.
+        With a `frame_range` only presses inside it are returned, clipped to its first and last frame.
+        """
+        spans = self.note_spans
+        start_frames, end_frames = spans.get_frames(fps, speed)
+        notes = spans.notes
+        velocities = spans.velocities
+
+        indices = None
+        if frame_range is not None:
+            # Look a bit further back and ahead so presses merge the same way as for the whole track
+            indices = spans.get_window_indices(fps, speed, frame_range[0] - min_gap, frame_range[1] + min_gap)
+
+        key_presses = KeyPresses()
+        press_end_frames = key_presses.end_frames
+        # Index of the last press per note, -1 = none yet
+        open_presses = [-1] * 128
+        for index in spans.get_span_indices(note_mask, indices):
+            note = notes[index]
+            open_press = open_presses[note]
+            if open_press >= 0 and start_frames[index] - press_end_frames[open_press] < min_gap:
+                press_end_frames[open_press] = max(press_end_frames[open_press], end_frames[index])
+                continue
+            open_presses[note] = len(key_presses)
+            key_presses.append(note, start_frames[index], end_frames[index], velocities[index])
+
+        if frame_range is not None:
+            first_frame, last_frame = frame_range
+            clipped_presses = KeyPresses()
+            for note, start_frame, end_frame, velocity in key_presses:
+                # Presses after the range were only there to extend the ones inside it
+                if end_frame >= first_frame and start_frame <= last_frame:
+                    clipped_presses.append(note, max(start_frame, first_frame), min(end_frame, last_frame), velocity)
+            key_presses = clipped_presses
+        return key_presses
+
+class ControllerCurve:
+    """Values of one controller (or pitch bend) in a track, normalized to 0 - 1 (pitch bend is centered on 0.5)"""
+
+    def __init__(self) -> None:
+        self.seconds = array("d")
+        self.values = array("d")
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def from_reader(cls, reader, track, tempo_map, controller, channel=None):
+        # `channel` None reads every channel (0 - 15 otherwise)
+        ticks = array("Q")
+        values = array("d")
+        for tick, status, data1, data2 in reader.iter_events(track):
+            if status >= 0xF0 or (channel is not None and status & 0x0F != channel):
+                continue
+            message_type = status & 0xF0
+            if message_type == 0xB0 and data1 == controller:
+                value = data2 / 127
+            elif message_type == 0xE0 and controller == PITCH_BEND_CONTROLLER:
+                # Centre (8192) has to be exactly 0.5, the top end stays just below 1
+                value = (((data2 << 7) | data1) - 8192) / 16384 + 0.5
+            else:
+                continue
+            # Only the last value on a tick counts
+            if ticks and ticks[-1] == tick:
+                values[-1] = value
+                continue
+            ticks.append(tick)
+            values.append(value)
+
+        curve = cls()
+        curve.seconds = tempo_map.ticks_to_seconds(ticks)
+        curve.values = values
+        return curve
+
+    def resample(self, fps, speed):
+        """Returns (first frame, value per frame) from the first event to the last
+
+        Controllers hold their value until the next event, so each frame gets the last value before it.
+        """
+        if len(self) == 0:
+            return 0, array("d")
+        # Same timing as notes
+        frames = [(seconds * speed * fps) + 1 for seconds in (self.seconds[0], self.seconds[-1])]
+        first_frame = int(frames[0])
+        frame_count = int(frames[1]) - first_frame + 1
+
+        resampled = array("d", [0.0]) * frame_count
+        values = self.values
+        event_seconds = self.seconds
+        index = 0
+        for frame_index in range(frame_count):
+            frame_seconds = (first_frame + frame_index - 1) / (speed * fps)
+            while index + 1 < len(values) and event_seconds[index + 1] <= frame_seconds:
+                index += 1
+            resampled[frame_index] = values[index]
+        return first_frame, resampled
+
+class TrackInfo:
+    """Summary of a track for the track list, filled in as we learn more about it"""
+
+    def __init__(self, track, name, has_channel_messages) -> None:
+        self.track = track
+        self.name = name
+        self.has_channel_messages = has_channel_messages
+        # Only known once the track has been compiled
+        self.note_count = None
+        self.channels = None
+        self.pitch_range = None
+
+    def update_from_timeline(self, timeline):
+        # A `note_on` with 0 velocity is a `note_off`
+        self.note_count = sum(1 for velocity, pressed in zip(timeline.velocities, timeline.pressed) if pressed and velocity > 0)
+        self.channels = sorted(set(timeline.channels))
+        self.pitch_range = (min(timeline.notes), max(timeline.notes)) if len(timeline) > 0 else None
+
+    def get_enum_item(self):
+        label = "Track {} {}".format(self.track, self.name)
+        description = ""
+        if self.note_count is not None:
+            label = "{} ({} notes)".format(label, self.note_count)
+            description = "Channels: {}".format(", ".join(str(channel + 1) for channel in self.channels))
+            if self.pitch_range is not None:
+                description += ", Notes: {}-{}".format(*self.pitch_range)
+        return ("{}".format(self.track), label, description)
+
+class CachedMidiFile:
+    """A parsed MIDI file and the timelines compiled from its tracks"""
+
+    def __init__(self, key) -> None:
+        self.key = key
+        # Read on first use, so tracks loaded from the disk cache never touch the file
+        self.reader = None
+        self.content_hash = None
+        # Track number -> ParsedMidiFile
+        self.tracks = {}
+        # (track number, controller, channel) -> ControllerCurve
+        self.controller_curves = {}
+        # Track number -> TrackInfo, scanned once for the track list
+        self.track_index = None
+        self.track_items = None
+        self.size = 0
+
+    def get_reader(self):
+        if self.reader is None:
+            print("Loading MIDI file...") 
+            self.reader = MidiFileReader(self.key[0])
+            self.size += len(self.reader.data)
+
+            # Debug mode - check our reader against `mido`
+            if os.environ.get("MIDI_KEYFRAMES_VERIFY_READER"):
+                for error in self.reader.verify_against_mido():
+                    print("MIDI reader mismatch in {}: {}".format(self.key[0], error))
+        return self.reader
+
+    def get_content_hash(self):
+        if self.content_hash is None:
+            if self.reader is not None:
+                self.content_hash = hashlib.blake2b(self.reader.data, digest_size=16).digest()
+            else:
+                with open(self.key[0], "rb") as midi_file:
+                    self.content_hash = hashlib.blake2b(midi_file.read(), digest_size=16).digest()
+        return self.content_hash
+
+    def get_parsed_track(self, selected_track, timeline_cache_dir=None):
+        parsed = self.tracks.get(selected_track)
+        if parsed is not None:
+            return parsed
+
+        # Try the on-disk cache before parsing
+        cache_path = None
+        if timeline_cache_dir is not None:
+            content_hash = self.get_content_hash()
+            cache_path = os.path.join(timeline_cache_dir, "{}.track{}{}".format(content_hash.hex(), selected_track, TIMELINE_CACHE_EXTENSION))
+            parsed = ParsedMidiFile.load_timeline(cache_path, content_hash, selected_track)
+
+        if parsed is None:
+            parsed = ParsedMidiFile(self.key[0], selected_track, self.get_reader())
+            if cache_path is not None:
+                try:
+                    parsed.save_timeline(cache_path, content_hash)
+                except OSError as error:
+                    print("Couldn't save MIDI timeline cache: {}".format(error))
+
+        self.tracks[selected_track] = parsed
+        self.size += sum(column.itemsize * len(column) for column in parsed.get_timeline_columns())
+
+        # Now that we walked the whole track, the track list can show more info. Only when the list is already
+        # there, building it reads the file and a track from the disk cache doesn't need that
+        if self.track_index is not None:
+            self.update_track_info(selected_track, parsed)
+        return parsed
+
+    def update_track_info(self, selected_track, parsed):
+        track_info = self.track_index.get(int(selected_track))
+        if track_info is not None:
+            track_info.update_from_timeline(parsed.timeline)
+            self.track_items = None
+
+    def get_controller_curve(self, selected_track, controller, channel=None, timeline_cache_dir=None):
+        # Controllers aren't part of the timeline, but they use the track's tempo map
+        curve_key = (selected_track, controller, channel)
+        curve = self.controller_curves.get(curve_key)
+        if curve is None:
+            tempo_map = self.get_parsed_track(selected_track, timeline_cache_dir).tempo_map
+            curve = ControllerCurve.from_reader(self.get_reader(), selected_track, tempo_map, controller, channel)
+            self.controller_curves[curve_key] = curve
+            self.size += curve.seconds.itemsize * len(curve) + curve.values.itemsize * len(curve)
+        return curve
+
+    def get_track_index(self):
+        if self.track_index is None:
+            reader = self.get_reader()
+            self.track_index = {track: reader.scan_track(track) for track in range(len(reader.track_chunks))}
+            for selected_track, parsed in self.tracks.items():
+                self.update_track_info(selected_track, parsed)
+        return self.track_index
+
+    def get_track_items(self):
+        # Tracks with at least one channel message, as items for the track enum
+        if self.track_items is None:
+            self.track_items = [track_info.get_enum_item() for track_info in self.get_track_index().values() if track_info.has_channel_messages]
+        return self.track_items
+
+def compile_midi_file(midi_file_path, selected_tracks, timeline_cache_dir):
+    """Compiles tracks of a MIDI file into the on-disk timeline cache
+
+    Runs in worker processes without Blender (see `batch.py`), `selected_tracks` None compiles every track
+    with channel messages. Returns the note count of each compiled track and how long it took.
+    """
+    start_time = time.perf_counter()
+    stat = os.stat(midi_file_path)
+    cached_file = CachedMidiFile((os.path.abspath(midi_file_path), stat.st_mtime_ns, stat.st_size))
+    if selected_tracks is None:
+        selected_tracks = [str(track) for track, track_info in cached_file.get_track_index().items() if track_info.has_channel_messages]
+
+    note_counts = {}
+    for selected_track in selected_tracks:
+        note_counts[selected_track] = len(cached_file.get_parsed_track(selected_track, timeline_cache_dir).note_spans)
+    return {"path": midi_file_path, "note_counts": note_counts, "seconds": time.perf_counter() - start_time}
@@ -0,0 +1,125 @@
+# Checks the instanced keyboard in a real Blender, `tests/test_blender.py` runs it when `blender` is on the PATH
+#
+# blender -b --factory-startup --python tests/blender_smoke.py [-- --playback]
+#
+# Builds a keyboard from 88 key objects and checks that pressing a key moves the instance of its own object,
+# which only works when the Index Switch items line up with the Collection Info instance order.
+# --playback also generates keys for a MIDI file with both outputs and prints the playback frame rate.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import bpy
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import benchmark
+
+KEY_COUNT = 88
+
+
+def setup_scene(addon):
+    scene = bpy.context.scene
+    bpy.ops.wm.initialise_key_list()
+    midi_keyframe_props = scene.midi_keyframe_props
+
+    # "Key 1" - "Key 88", so name order and natural order differ ("Key 10" < "Key 2")
+    collection = bpy.data.collections.new("Keys")
+    scene.collection.children.link(collection)
+    mesh = bpy.data.meshes.new("Key")
+    for index in range(KEY_COUNT):
+        key_obj = bpy.data.objects.new("Key {}".format(index + 1), mesh)
+        key_obj.location = (index * 0.25, 0.0, 0.0)
+        collection.objects.link(key_obj)
+        midi_keyframe_props.keys[index].obj = key_obj
+    bpy.context.view_layer.active_layer_collection = bpy.context.view_layer.layer_collection.children[collection.name]
+    return collection
+
+def get_instance_locations(keyboard_obj):
+    # Instanced object name -> location of its instance
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    locations = {}
+    for instance in depsgraph.object_instances:
+        if instance.is_instance and instance.parent is not None and instance.parent.original == keyboard_obj:
+            locations[instance.instance_object.original.name] = instance.matrix_world.translation.copy()
+    return locations
+
+def check_instanced_keyboard(addon):
+    midi_keyframe_props = bpy.context.scene.midi_keyframe_props
+    assert bpy.ops.wm.create_instanced_keyboard() == {"FINISHED"}
+    keyboard_obj = midi_keyframe_props.keyboard_obj
+    node_tree = addon.get_keyboard_node_group(keyboard_obj)
+    addon.update_keyboard_offsets(node_tree, midi_keyframe_props)
+
+    rest_locations = get_instance_locations(keyboard_obj)
+    assert len(rest_locations) == KEY_COUNT, "{} instances".format(len(rest_locations))
+    for key in midi_keyframe_props.keys:
+        assert (rest_locations[key.obj.name] - key.obj.location).length < 1e-5, key.obj.name
+
+    # Press each key on its own, only its object's instance may move (down by the travel distance)
+    for key in midi_keyframe_props.keys:
+        value_node = node_tree.nodes[addon.get_keyboard_value_node_name(key.instance_index)]
+        value_node.outputs[0].default_value = 1.0
+        node_tree.update_tag()
+        locations = get_instance_locations(keyboard_obj)
+        value_node.outputs[0].default_value = 0.0
+        node_tree.update_tag()
+        for name, location in locations.items():
+            expected_offset = -midi_keyframe_props.travel_distance if name == key.obj.name else 0.0
+            assert abs(location.z - rest_locations[name].z - expected_offset) < 1e-5, "Pressing {} moved {}".format(key.obj.name, name)
+
+def measure_playback_fps(scene, frame_count):
+    scene.frame_set(scene.frame_start)
+    start_time = time.perf_counter()
+    for frame in range(scene.frame_start, scene.frame_start + frame_count):
+        scene.frame_set(frame)
+    return frame_count / (time.perf_counter() - start_time)
+
+def compare_playback(addon, midi_file_path, frame_count):
+    scene = bpy.context.scene
+    midi_keyframe_props = scene.midi_keyframe_props
+    midi_keyframe_props.midi_file = midi_file_path
+    scene.frame_start = 1
+    scene.frame_end = frame_count
+
+    midi_keyframe_props.output_target = "OBJECTS"
+    assert bpy.ops.wm.generate_piano_animation('EXEC_DEFAULT') == {"FINISHED"}
+    object_fps = measure_playback_fps(scene, frame_count)
+
+    # Creating the keyboard hides the key objects and switches the output to the keyboard
+    bpy.ops.wm.delete_all_keyframes('EXEC_DEFAULT')
+    check_instanced_keyboard(addon)
+    assert bpy.ops.wm.generate_piano_animation('EXEC_DEFAULT') == {"FINISHED"}
+    instanced_fps = measure_playback_fps(scene, frame_count)
+    print("Playback: {:.1f} fps with key objects, {:.1f} fps instanced ({} frames)".format(object_fps, instanced_fps, frame_count))
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description="Instanced keyboard smoke test")
+    parser.add_argument("--playback", action="store_true", help="Compare playback fps of key objects and the instanced keyboard")
+    parser.add_argument("--events", type=int, default=20000, help="Note events in the generated file for --playback")
+    parser.add_argument("--frames", type=int, default=500, help="Frames to play for --playback")
+    args = parser.parse_args(argv)
+
+    addon = benchmark.load_addon()
+    addon.register()
+    setup_scene(addon)
+    if args.playback:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            midi_file_path = benchmark.generate_midi_file(os.path.join(temp_dir, "playback.mid"), events=args.events, tracks=1)
+            compare_playback(addon, midi_file_path, args.frames)
+    else:
+        check_instanced_keyboard(addon)
+    print("Instanced keyboard OK")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
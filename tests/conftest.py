@@ -0,0 +1,32 @@
+# Tests run without Blender, the addon gets loaded with the in-memory `bpy` stand-in from benchmark.py
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import benchmark
+
+# pytest imports the addon's `__init__.py` as the package of the tests, so `bpy` has to exist before that
+try:
+    import bpy
+except ImportError:
+    benchmark.install_fake_bpy()
+
+
+@pytest.fixture(scope="session")
+def addon():
+    return benchmark.load_addon()
+
+@pytest.fixture(scope="session")
+def midi_timeline(addon):
+    # The module the addon imported, so its classes are the ones the addon uses
+    return sys.modules[addon.__name__ + ".midi_timeline"]
+
+@pytest.fixture
+def generate_midi_file(tmp_path):
+    def generate(name="test.mid", **kwargs):
+        return benchmark.generate_midi_file(str(tmp_path / name), **kwargs)
+    return generate
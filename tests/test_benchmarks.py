@@ -0,0 +1,19 @@
+# Timings with pytest-benchmark: `python -m pytest tests/test_benchmarks.py --benchmark-autosave`, then
+# `--benchmark-compare --benchmark-compare-fail=median:25%` to fail on regressions
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import benchmark as benchmark_script
+
+BENCHMARK_NAMES = ["parse", "build_timeline", "key_presses", "animate_keys_bulk", "animate_keys_insert", "animate_jump"]
+
+
+@pytest.fixture(scope="module")
+def benchmarks(addon, tmp_path_factory):
+    midi_file_path = benchmark_script.generate_midi_file(str(tmp_path_factory.mktemp("benchmark") / "benchmark.mid"), events=20000)
+    return benchmark_script.get_benchmarks(addon, midi_file_path, "1")
+
+@pytest.mark.parametrize("name", BENCHMARK_NAMES)
+def test_benchmark(benchmarks, benchmark, name):
+    benchmark(benchmarks[name])
@@ -0,0 +1,25 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+BLENDER = shutil.which("blender")
+SMOKE_TEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_smoke.py")
+
+pytestmark = pytest.mark.skipif(BLENDER is None, reason="needs `blender` on the PATH")
+
+
+def run_smoke_test(*args):
+    result = subprocess.run([BLENDER, "-b", "--factory-startup", "--python", SMOKE_TEST_PATH, "--", *args], capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0 and "Instanced keyboard OK" in result.stdout, result.stdout + result.stderr
+    return result.stdout
+
+def test_instanced_keyboard():
+    run_smoke_test()
+
+def test_playback(capsys):
+    output = run_smoke_test("--playback", "--events", "4000", "--frames", "100")
+    with capsys.disabled():
+        sys.stdout.write("".join(line + "\n" for line in output.splitlines() if line.startswith("Playback:")))
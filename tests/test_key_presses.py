@@ -0,0 +1,23 @@
+import random
+
+import pytest
+
+
+@pytest.mark.parametrize("min_gap", [1, 4])
+def test_frame_range_matches_whole_track(midi_timeline, generate_midi_file, min_gap):
+    # Presses in a window have to be the presses of the whole track, clipped to the window
+    parsed = midi_timeline.ParsedMidiFile(generate_midi_file(events=4000, tracks=1, seed=6), "1")
+    whole_track = list(parsed.get_key_presses(30, 1.0, min_gap=min_gap))
+    last_frame = max(end_frame for note, start_frame, end_frame, velocity in whole_track)
+
+    rng = random.Random(0)
+    for _ in range(200):
+        first_frame = rng.uniform(0, last_frame)
+        frame_range = (first_frame, first_frame + rng.uniform(0, 100))
+        expected = sorted(
+            (note, max(start_frame, frame_range[0]), min(end_frame, frame_range[1]))
+            for note, start_frame, end_frame, velocity in whole_track
+            if end_frame >= frame_range[0] and start_frame <= frame_range[1]
+        )
+        window = sorted((note, start_frame, end_frame) for note, start_frame, end_frame, velocity in parsed.get_key_presses(30, 1.0, min_gap=min_gap, frame_range=frame_range))
+        assert window == expected, frame_range
@@ -0,0 +1,226 @@
+import json
+import types
+
+import pytest
+
+import benchmark
+
+
+def get_location_keys(obj, index=2):
+    coords = obj.animation_data.action.fcurves.find("location", index).keyframe_points.coords
+    return list(zip(coords[0::2], coords[1::2]))
+
+def generate_keys(addon, midi_timeline, midi_file_path, context):
+    midi_keyframe_props = context.scene.midi_keyframe_props
+    parsed = midi_timeline.ParsedMidiFile(midi_file_path, "1")
+    target = addon.KeyAnimationTarget.from_keys(midi_keyframe_props, midi_keyframe_props.keys)
+    keyframe_writer = addon.KeyframeWriter.from_settings(midi_keyframe_props)
+    key_presses = list(parsed.get_key_presses(context.scene.render.fps, midi_keyframe_props.speed, target.note_mask))
+    for key_press in key_presses:
+        addon.animate_keys(context, *key_press, target=target, keyframe_writer=keyframe_writer)
+    keyframe_writer.flush()
+    return target, key_presses
+
+
+def test_simplify_keeps_releases(addon, midi_timeline, generate_midi_file):
+    # Releases are one frame after the hold, float error can make that slightly less than a frame
+    midi_file_path = generate_midi_file(events=4000, tracks=1, seed=3)
+    context = benchmark.make_context(addon)
+    target, key_presses = generate_keys(addon, midi_timeline, midi_file_path, context)
+
+    for midi_note, start_frame, end_frame, velocity in key_presses:
+        keys = dict(get_location_keys(target.note_objects[midi_note]))
+        rest_value = target.rest_values[midi_note][2]
+        # Every press has to end at rest within a frame, unless the same key gets pressed again right away
+        pressed_again = any(note == midi_note and end_frame < start <= end_frame + 2 for note, start, end, _ in key_presses)
+        if not pressed_again:
+            release_frames = [frame for frame in keys if end_frame < frame <= end_frame + 1.5]
+            assert release_frames and keys[min(release_frames)] == rest_value, (midi_note, end_frame)
+
+def test_simplify_never_merges_different_values(addon):
+    keys = {10.0: (0.0, 0), 10.4: (1.0, 1), 11.0: (1.0, 1), 11.99999: (0.0, 0)}
+    simplified = addon.simplify_keyframes(keys, 0.0001)
+    assert [value for frame, value in simplified] == [0.0, 1.0, 1.0, 0.0]
+
+def run_generate_operator(addon, context, operator_class=None):
+    operator = (operator_class or addon.GI_generate_piano_animation)()
+    operator.report = lambda *args: None
+    assert operator.execute(context) == {"FINISHED"}
+
+def test_regenerating_clears_objects_that_are_no_keys_anymore(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=4000, tracks=1, seed=1))
+    midi_keyframe_props = context.scene.midi_keyframe_props
+    run_generate_operator(addon, context)
+
+    # Give the busiest key a new object
+    key = max(midi_keyframe_props.keys, key=lambda key: len(key.obj.animation_data.action.fcurves) if key.obj.animation_data else 0)
+    old_obj = key.obj
+    assert len(get_location_keys(old_obj)) > 0
+    key.obj = benchmark.FakeObject(old_obj.name + ".new", old_obj.location)
+    run_generate_operator(addon, context)
+
+    assert old_obj.animation_data.action.fcurves == []
+    assert len(get_location_keys(key.obj)) > 0
+    assert "OBJECT:" + old_obj.name not in json.loads(midi_keyframe_props.generation_fingerprint)["ids"]
+
+def test_failed_generation_stops_the_modal_operator(addon, generate_midi_file, monkeypatch):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=400, tracks=1, seed=2))
+    timers = []
+    context.window = None
+    context.screen = types.SimpleNamespace(areas=[])
+    context.window_manager = types.SimpleNamespace(
+        event_timer_add=lambda time_step, window=None: timers.append(object()) or timers[-1],
+        event_timer_remove=timers.remove,
+        modal_handler_add=lambda operator: None,
+    )
+    operator = addon.GI_generate_piano_animation()
+    assert operator.invoke(context, None) == {"RUNNING_MODAL"}
+    operator.worker.join()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("animate_keys failed")
+    monkeypatch.setattr(addon, "animate_keys", fail)
+    with pytest.raises(RuntimeError):
+        operator.modal(context, types.SimpleNamespace(type="TIMER"))
+    assert timers == []
+    assert addon.generation_progress is None
+
+def start_modal_operator(addon, context):
+    context.window = None
+    context.screen = types.SimpleNamespace(areas=[])
+    context.window_manager = types.SimpleNamespace(
+        event_timer_add=lambda time_step, window=None: object(),
+        event_timer_remove=lambda timer: None,
+        modal_handler_add=lambda operator: None,
+    )
+    operator = addon.GI_generate_piano_animation()
+    operator.report = lambda *args: None
+    assert operator.invoke(context, None) == {"RUNNING_MODAL"}
+    operator.worker.join()
+    return operator
+
+def test_modal_generation_writes_in_slices(addon, generate_midi_file):
+    midi_file_path = generate_midi_file(events=400, tracks=1, seed=2)
+    context = benchmark.make_context(addon, midi_file=midi_file_path)
+    run_generate_operator(addon, context)
+    expected = {key.obj.name: get_location_keys(key.obj) for key in context.scene.midi_keyframe_props.keys if key.obj.animation_data is not None}
+
+    # Every tick runs out of time after one key press or one F-curve
+    context = benchmark.make_context(addon, midi_file=midi_file_path)
+    context.scene.midi_keyframe_props.time_budget = 0.0
+    operator = start_modal_operator(addon, context)
+    progress = []
+    result = {"PASS_THROUGH"}
+    while result == {"PASS_THROUGH"}:
+        result = operator.modal(context, types.SimpleNamespace(type="TIMER"))
+        progress.append(addon.generation_progress)
+        # Once writing started it can't be cancelled halfway anymore
+        if operator.write_steps is not None:
+            assert operator.modal(context, types.SimpleNamespace(type="ESC")) == {"PASS_THROUGH"}
+    assert result == {"FINISHED"}
+    assert sum(1 for value in progress if value is not None and value > 0.5) > 1
+    assert progress[:-1] == sorted(progress[:-1])
+    assert {key.obj.name: get_location_keys(key.obj) for key in context.scene.midi_keyframe_props.keys if key.obj.animation_data is not None} == expected
+
+def test_modal_generation_skips_deleted_objects(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=400, tracks=1, seed=2))
+    context.scene.midi_keyframe_props.time_budget = 0.0
+    operator = start_modal_operator(addon, context)
+    result = {"PASS_THROUGH"}
+    while operator.write_steps is None:
+        result = operator.modal(context, types.SimpleNamespace(type="TIMER"))
+    # Deleted while the keys were collected, but before they got written
+    key_objects = sorted({obj for obj, data_path, index in operator.keyframe_writer.channels}, key=lambda obj: obj.name)
+    deleted_obj = key_objects[-1]
+    del addon.bpy.data.objects[deleted_obj.name]
+
+    while result == {"PASS_THROUGH"}:
+        result = operator.modal(context, types.SimpleNamespace(type="TIMER"))
+    assert deleted_obj.animation_data is None
+    assert any(obj.animation_data is not None for obj in key_objects)
+
+def test_regenerating_the_jump_keeps_its_base(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=400, tracks=1, seed=8))
+    obj_jump = context.scene.midi_keyframe_props.obj_jump
+    obj_jump.location = (0.0, 1.0, 2.0)
+    run_generate_operator(addon, context, addon.GI_generate_jumping_animation)
+    keys = [get_location_keys(obj_jump, index) for index in range(3)]
+
+    # Like playback stopped mid jump
+    obj_jump.location = (5.0, 1.0, max(value for frame, value in keys[2]))
+    run_generate_operator(addon, context, addon.GI_generate_jumping_animation)
+    assert [get_location_keys(obj_jump, index) for index in range(3)] == keys
+
+def test_regenerating_starts_from_the_rest_pose(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=400, tracks=1, seed=9))
+    midi_keyframe_props = context.scene.midi_keyframe_props
+    run_generate_operator(addon, context)
+    key_obj = next(key.obj for key in midi_keyframe_props.keys if key.obj.animation_data is not None)
+    assert {value for frame, value in get_location_keys(key_obj)} == {-1.0, 0.0}
+
+    # The playhead is on a pressed frame
+    key_obj.location = (key_obj.location.x, key_obj.location.y, -1.0)
+    midi_keyframe_props.travel_distance = 2.0
+    run_generate_operator(addon, context)
+    assert {value for frame, value in get_location_keys(key_obj)} == {-2.0, 0.0}
+
+def get_min_location_key(midi_keyframe_props):
+    return min(value for key in midi_keyframe_props.keys if key.obj.animation_data is not None for frame, value in get_location_keys(key.obj))
+
+def test_frame_range_runs_invalidate_the_fingerprint(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=2000, tracks=1, seed=10))
+    midi_keyframe_props = context.scene.midi_keyframe_props
+    run_generate_operator(addon, context)
+    assert get_min_location_key(midi_keyframe_props) == -1.0
+
+    midi_keyframe_props.frame_range = "CUSTOM"
+    midi_keyframe_props.frame_range_start, midi_keyframe_props.frame_range_end = 100, 200
+    midi_keyframe_props.travel_distance = 3.0
+    run_generate_operator(addon, context)
+    assert get_min_location_key(midi_keyframe_props) == -3.0
+
+    midi_keyframe_props.frame_range = "ALL"
+    midi_keyframe_props.travel_distance = 1.0
+    run_generate_operator(addon, context)
+    assert get_min_location_key(midi_keyframe_props) == -1.0
+
+def test_moved_key_objects_get_regenerated(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=400, tracks=1, seed=11))
+    midi_keyframe_props = context.scene.midi_keyframe_props
+    run_generate_operator(addon, context)
+
+    # Keys removed outside of the addon, then the object got moved
+    key_obj = next(key.obj for key in midi_keyframe_props.keys if key.obj.animation_data is not None)
+    key_obj.animation_data = None
+    key_obj.location = (key_obj.location.x, key_obj.location.y, 0.5)
+    run_generate_operator(addon, context)
+    assert {value for frame, value in get_location_keys(key_obj)} == {-0.5, 0.5}
+
+def test_switching_off_the_keyboard_clears_its_node_group(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=400, tracks=1, seed=12))
+    midi_keyframe_props = context.scene.midi_keyframe_props
+    # The keyboard object and its node group have the same name
+    nodes = {name: types.SimpleNamespace(name=name, vector=None) for name in addon.KEYBOARD_OFFSET_NODES.values()}
+    for instance_index, key in enumerate(midi_keyframe_props.keys):
+        key.instance_index = instance_index
+        nodes[addon.get_keyboard_value_node_name(instance_index)] = types.SimpleNamespace(name=addon.get_keyboard_value_node_name(instance_index))
+    node_tree = benchmark.FakeNodeTree("MIDI Keyboard", nodes)
+    midi_keyframe_props.keyboard_obj = benchmark.FakeObject("MIDI Keyboard")
+    midi_keyframe_props.keyboard_obj.modifiers = [types.SimpleNamespace(type="NODES", node_group=node_tree)]
+    midi_keyframe_props.output_target = "INSTANCES"
+    run_generate_operator(addon, context)
+    assert len(node_tree.animation_data.action.fcurves) > 0
+
+    midi_keyframe_props.output_target = "OBJECTS"
+    run_generate_operator(addon, context)
+    assert node_tree.animation_data.action.fcurves == []
+    assert "NODETREE:MIDI Keyboard" not in json.loads(midi_keyframe_props.generation_fingerprint)["ids"]
+
+def test_instanced_keyboard_rejects_child_collections(addon):
+    context = benchmark.make_context(addon)
+    context.collection = types.SimpleNamespace(name="Keys", objects=[key.obj for key in context.scene.midi_keyframe_props.keys], children=[types.SimpleNamespace(name="Black Keys")])
+    reports = []
+    operator = addon.GI_create_instanced_keyboard()
+    operator.report = lambda level, message: reports.append(message)
+    assert operator.execute(context) == {"CANCELLED"}
+    assert "child collections" in reports[0]
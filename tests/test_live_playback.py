@@ -0,0 +1,48 @@
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def live_scene(addon, generate_midi_file):
+    context = benchmark.make_context(addon, midi_file=generate_midi_file(events=400, tracks=1, seed=13))
+    scene = context.scene
+    scene.midi_keyframe_props.live_playback = True
+
+    # A frame where the first key object is held down
+    live_playback = addon.get_live_playback(scene)
+    midi_note = live_playback.animated_notes[0]
+    scene.frame_current = (live_playback.press_starts[midi_note][0] + live_playback.press_ends[midi_note][0]) / 2
+    addon.live_playback_handler(scene)
+    yield scene, live_playback.target.note_objects[midi_note]
+    addon.live_playbacks.clear()
+
+def test_files_get_saved_at_rest(addon, live_scene):
+    scene, key_obj = live_scene
+    assert key_obj.location.z == -1.0
+    addon.rest_live_playbacks()
+    assert key_obj.location.z == 0.0
+    addon.pose_live_playbacks()
+    assert key_obj.location.z == -1.0
+
+def test_loading_a_file_drops_the_playbacks(addon, live_scene):
+    scene, key_obj = live_scene
+    addon.drop_live_playbacks("other.blend")
+    assert scene.name not in addon.live_playbacks
+    # The objects may be gone already, so nothing gets restored
+    assert key_obj.location.z == -1.0
+
+def test_failed_restore_drops_the_playback(addon, live_scene):
+    scene, key_obj = live_scene
+    live_playback = addon.live_playbacks[scene.name][1]
+
+    def restore():
+        raise ReferenceError("StructRNA of type Object has been removed")
+    live_playback.restore = restore
+    scene.midi_keyframe_props.travel_distance = 2.0
+    with pytest.raises(ReferenceError):
+        addon.live_playback_handler(scene)
+
+    # The next frame change starts over instead of failing again
+    addon.live_playback_handler(scene)
+    assert addon.live_playbacks[scene.name][1] is not live_playback
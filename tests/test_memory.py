@@ -0,0 +1,9 @@
+import benchmark
+
+
+def test_parse_memory_stays_under_budget(addon, generate_midi_file):
+    # Same check as `python benchmark.py`, on a file big enough that the per event cost dominates
+    midi_file_path = generate_midi_file(events=50000, tracks=1, seed=7)
+    peak_memory, event_count = benchmark.measure_peak_memory(addon, midi_file_path, "1")
+    assert event_count > 25000
+    assert peak_memory / 1024 / 1024 <= benchmark.get_memory_budget(event_count)
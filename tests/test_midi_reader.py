@@ -0,0 +1,57 @@
+import struct
+
+import pytest
+
+mido = pytest.importorskip("mido")
+
+
+def write_midi_file(path, file_type, tracks):
+    # `tracks` are lists of raw event bytes (delta time included)
+    with open(path, "wb") as midi_file:
+        midi_file.write(b"MThd" + struct.pack(">LhhH", 6, file_type, len(tracks), 96))
+        for events in tracks:
+            data = b"".join(events) + b"\x00\xff\x2f\x00"
+            midi_file.write(b"MTrk" + struct.pack(">L", len(data)) + data)
+    return str(path)
+
+
+@pytest.mark.parametrize("seed,tracks,polyphony", [(0, 1, 1), (1, 4, 3), (2, 8, 6), (3, 16, 2)])
+def test_generated_files_match_mido(midi_timeline, generate_midi_file, seed, tracks, polyphony):
+    midi_file_path = generate_midi_file(events=4000, tracks=tracks, polyphony=polyphony, tempo_changes=seed * 8, seed=seed)
+    assert midi_timeline.MidiFileReader(midi_file_path).verify_against_mido() == []
+
+def test_running_status_sysex_and_meta_match_mido(midi_timeline, tmp_path):
+    events = [
+        b"\x00\xff\x03\x05Piano",
+        # Running status note on/off and a long delta time
+        b"\x00\x90\x3c\x40", b"\x60\x3e\x40", b"\x81\x00\x3c\x00", b"\x00\x3e\x00",
+        # One data byte messages, pitch bend and control change
+        b"\x00\xc0\x05", b"\x00\xd0\x30", b"\x10\xe0\x00\x40", b"\x00\xb0\x40\x7f", b"\x00\x01\x20",
+        # Sysex in between doesn't change the running status
+        b"\x00\xf0\x03\x7e\x7f\xf7", b"\x00\xb0\x40\x00",
+        b"\x00\xff\x51\x03\x07\xa1\x20",
+    ]
+    midi_file_path = write_midi_file(tmp_path / "events.mid", 0, [events])
+    assert midi_timeline.MidiFileReader(midi_file_path).verify_against_mido() == []
+
+def test_type_2_files_match_mido(midi_timeline, tmp_path):
+    tracks = [[b"\x00\xff\x51\x03\x0f\x42\x40", b"\x00\x90\x3c\x40", b"\x60\x80\x3c\x40"] for _ in range(3)]
+    midi_file_path = write_midi_file(tmp_path / "type2.mid", 2, tracks)
+    assert midi_timeline.MidiFileReader(midi_file_path).verify_against_mido() == []
+
+def test_notes_match_mido_for_every_track(midi_timeline, generate_midi_file):
+    midi_file_path = generate_midi_file(events=4000, tracks=3, seed=5)
+    mido_file = mido.MidiFile(midi_file_path)
+    for track in range(1, len(mido_file.tracks)):
+        expected = [(msg.type == "note_on", msg.note, msg.velocity) for msg in mido_file.tracks[track] if msg.type in ("note_on", "note_off")]
+        timeline = midi_timeline.ParsedMidiFile(midi_file_path, str(track)).timeline
+        assert list(zip(map(bool, timeline.pressed), timeline.notes, timeline.velocities)) == expected
+
+def test_pitch_bend_is_centered(midi_timeline, tmp_path):
+    # Lowest, centre and highest bend, one tick apart
+    events = [b"\x00\xe0\x00\x00", b"\x01\xe0\x00\x40", b"\x01\xe0\x7f\x7f"]
+    midi_file_path = write_midi_file(tmp_path / "bend.mid", 0, [events])
+    reader = midi_timeline.MidiFileReader(midi_file_path)
+    tempo_map = midi_timeline.TempoMap.from_reader(reader, "0")
+    curve = midi_timeline.ControllerCurve.from_reader(reader, 0, tempo_map, midi_timeline.PITCH_BEND_CONTROLLER)
+    assert list(curve.values) == [0.0, 0.5, 16383 / 16384]
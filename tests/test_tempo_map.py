@@ -0,0 +1,48 @@
+import pytest
+
+mido = pytest.importorskip("mido")
+
+
+def get_mido_note_times(midi_file_path):
+    # mido merges all tracks and applies every tempo change it sees on the way
+    note_times = []
+    seconds = 0.0
+    for msg in mido.MidiFile(midi_file_path):
+        seconds += msg.time
+        if msg.type in ("note_on", "note_off"):
+            note_times.append((msg.type == "note_on", msg.note, msg.velocity, seconds))
+    return note_times
+
+def get_timeline_note_times(parsed):
+    timeline = parsed.timeline
+    return list(zip(map(bool, timeline.pressed), timeline.notes, timeline.velocities, timeline.seconds))
+
+def sort_note_times(note_times):
+    return sorted(note_times, key=lambda note_time: (round(note_time[3], 6), note_time[:3]))
+
+
+@pytest.mark.parametrize("seed,tempo_changes", [(0, 0), (1, 1), (2, 16), (3, 200)])
+def test_seconds_match_mido(midi_timeline, generate_midi_file, seed, tempo_changes):
+    # One tempo track plus one note track, so mido's merged timing covers exactly our track
+    midi_file_path = generate_midi_file(events=3000, tracks=1, tempo_changes=tempo_changes, seed=seed)
+    parsed = midi_timeline.ParsedMidiFile(midi_file_path, "1")
+
+    expected = sort_note_times(get_mido_note_times(midi_file_path))
+    actual = sort_note_times(get_timeline_note_times(parsed))
+    assert [note_time[:3] for note_time in actual] == [note_time[:3] for note_time in expected]
+    assert max(abs(a[3] - e[3]) for a, e in zip(actual, expected)) < 1e-9
+
+def test_tempo_changes_on_the_same_tick(midi_timeline):
+    # The later change on a tick wins, like it does when playing the file
+    tempo_map = midi_timeline.TempoMap(480, [(0, 400000), (960, 1000000), (960, 250000)])
+    assert list(tempo_map.ticks) == [0, 960]
+    assert list(tempo_map.tempos) == [400000, 250000]
+    assert list(tempo_map.ticks_to_seconds([0, 480, 960, 1440])) == pytest.approx([0.0, 0.4, 0.8, 1.05])
+
+def test_unsorted_ticks(midi_timeline):
+    # Note ends aren't sorted, the tempo has to be found again when a tick goes back
+    tempo_map = midi_timeline.TempoMap(480, [(0, 400000), (960, 250000), (1920, 1000000)])
+    ticks = [1440, 480, 2400, 0, 960, 1920]
+    expected = [1.05, 0.4, 2.3, 0.0, 0.8, 1.3]
+    assert list(tempo_map.ticks_to_seconds(ticks)) == pytest.approx(expected)
+    assert list(tempo_map.ticks_to_seconds(sorted(ticks))) == pytest.approx(sorted(expected))
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+
+def make_cached_file(midi_timeline, midi_file_path):
+    stat = os.stat(midi_file_path)
+    return midi_timeline.CachedMidiFile((os.path.abspath(midi_file_path), stat.st_mtime_ns, stat.st_size))
+
+def test_note_count_skips_note_ons_with_zero_velocity(midi_timeline, generate_midi_file):
+    # The generated file ends about half of its notes with 0 velocity note ons
+    midi_file_path = generate_midi_file(events=2000, tracks=1, seed=4)
+    cached_file = make_cached_file(midi_timeline, midi_file_path)
+    parsed = cached_file.get_parsed_track("1")
+
+    timeline = parsed.timeline
+    assert any(pressed and velocity == 0 for velocity, pressed in zip(timeline.velocities, timeline.pressed))
+    assert cached_file.get_track_index()[1].note_count == len(parsed.note_spans)
+
+def test_warm_cache_load_doesnt_read_the_file(midi_timeline, generate_midi_file, tmp_path, monkeypatch):
+    midi_file_path = generate_midi_file(events=2000, tracks=2, seed=5)
+    timeline_cache_dir = str(tmp_path / "cache")
+    os.mkdir(timeline_cache_dir)
+    make_cached_file(midi_timeline, midi_file_path).get_parsed_track("2", timeline_cache_dir)
+
+    def read_midi_file(midi_file_path):
+        pytest.fail("Read {} on a warm cache load".format(midi_file_path))
+    monkeypatch.setattr(midi_timeline, "MidiFileReader", read_midi_file)
+    cached_file = make_cached_file(midi_timeline, midi_file_path)
+    parsed = cached_file.get_parsed_track("2", timeline_cache_dir)
+    monkeypatch.undo()
+
+    # The track list still gets the info of the tracks loaded before it
+    assert cached_file.get_track_index()[2].note_count == len(parsed.note_spans)
+
+def test_warm_cache_load_maps_the_stored_columns(midi_timeline, generate_midi_file, tmp_path):
+    midi_file_path = generate_midi_file(events=4000, tracks=1, seed=14)
+    cache_path = str(tmp_path / "test.timeline")
+    content_hash = bytes(16)
+    parsed = midi_timeline.ParsedMidiFile(midi_file_path, "1")
+    parsed.save_timeline(cache_path, content_hash)
+
+    loaded = midi_timeline.ParsedMidiFile.load_timeline(cache_path, content_hash, "1")
+    # Stored note spans are used as they are, not paired again or copied out of the file
+    assert all(isinstance(column, memoryview) for column in loaded.get_timeline_columns())
+    assert [column.tolist() for column in loaded.get_timeline_columns()] == [list(column) for column in parsed.get_timeline_columns()]
+    assert list(loaded.get_key_presses(30, 1.0)) == list(parsed.get_key_presses(30, 1.0))
+
+    # Anything but the exact layout gets parsed again
+    with open(cache_path, "ab") as cache_file:
+        cache_file.write(b"\0")
+    assert midi_timeline.ParsedMidiFile.load_timeline(cache_path, content_hash, "1") is None